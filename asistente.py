@@ -1,24 +1,31 @@
 
+import perfil_arranque  # primero: marca el instante cero del perfil de arranque
 import os
-import webbrowser
-import whisper
-import ollama
-from gtts import gTTS
-import sounddevice as sd
-import soundfile as sf
-import uuid
 import logging
-import pygame
-import subprocess
 import time
 import numpy as np
 import sys
 import stat
+import threading
+import queue
+import html
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                             QLabel, QPushButton, QTextEdit, QLineEdit, QScrollArea)
-from PyQt5.QtCore import Qt, QSize, QThread, pyqtSignal
-from PyQt5.QtGui import QMovie, QPixmap, QIcon, QFont, QPalette, QColor, QTextCursor
-import librosa
+from PyQt5.QtCore import Qt, QSize, QThread, QTimer, pyqtSignal
+from PyQt5.QtGui import QMovie, QPixmap, QIcon, QFont, QPalette, QColor, QTextCursor, QTextCharFormat
+
+import configuracion
+import nucleo
+from captura import DetectorVoz, ServicioCaptura, grabar_hasta_silencio, esperar_interrupcion
+from procesamiento_audio import FrontendAudio
+from asr import crear_backend_asr
+from proceso_asr import ASRCancelado, ServicioASRProcesos
+from tts import SegmentadorFrases, segmentar_texto
+from sesiones import GestorSesiones
+from palabra_clave import DetectorPalabraClave, EscuchaPalabraClave, crear_verificador_asr
+from salida_audio import ServicioSalidaAudio, PRIORIDAD_NORMAL, decodificar_audio
+
+perfil_arranque.marcar("importaciones")
 
 if 'DISPLAY' not in os.environ:
     os.environ['QT_QPA_PLATFORM'] = 'xcb'
@@ -27,16 +34,6 @@ if 'DISPLAY' not in os.environ:
 
 os.environ['QT_QPA_PLATFORM'] = 'windows' 
 
-# Configuración de logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(os.path.dirname(__file__), 'asistente.log')),
-        logging.StreamHandler()
-    ]
-)
-
 def verificar_sistema():
     """Verifica y crea la estructura necesaria de directorios y permisos"""
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -66,22 +63,58 @@ def verificar_sistema():
 
 # Configuración inicial
 script_dir = os.path.dirname(os.path.abspath(__file__))
-temp_audio_dir = os.path.join(script_dir, "temp_audio")
-temp_audio_path = os.path.join(temp_audio_dir, "grabacion.wav")
-conversacion_path = os.path.join(script_dir, "conversacion.txt")
 
-verificar_sistema()
+model_name = configuracion.llm_modelo
+nombre_asistente = configuracion.nombre_asistente
+nombre_usuario = None
 
-# Cargar modelos
-try:
-    whisper_model = whisper.load_model("small")
-except Exception as e:
-    logging.critical(f"Error cargando modelo Whisper: {str(e)}")
-    sys.exit(1)
+# Estado compartido de la aplicación: se crea en inicializar() y no al importar, porque
+# los procesos ASR (spawn) vuelven a importar este script como __mp_main__
+motor_tts = None
+cache_tts = None
+cache_respuestas = None
+salida = None
+microfono = None
+sesiones = None
 
-model_name = "mistral"
-nombre_asistente = "ELISA"
-nombre_usuario = None
+def inicializar():
+    global motor_tts, cache_tts, cache_respuestas, salida, microfono, sesiones
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(os.path.join(os.path.dirname(__file__), 'asistente.log')),
+            logging.StreamHandler()
+        ]
+    )
+    verificar_sistema()
+
+    # El modelo ASR se carga en segundo plano (WorkerCargaModelo) tras mostrar la ventana
+    motor_tts = nucleo.crear_tts()
+    cache_tts = motor_tts.cache
+    cache_respuestas = nucleo.crear_cache_respuestas()
+    salida = ServicioSalidaAudio(configuracion.salida_samplerate)
+    microfono = ServicioCaptura(configuracion.asr_samplerate,
+                                int(configuracion.asr_samplerate * configuracion.vad_bloque_ms / 1000),
+                                configuracion.captura_buffer_segundos)
+    perfil_arranque.marcar("configuración y TTS")
+
+    # Cada ventana es una sesión: historial, audio temporal y registro de conversación propios
+    sesiones = GestorSesiones(
+        nombre_asistente,
+        configuracion.sesiones_dir_temporal,
+        configuracion.sesiones_dir_conversaciones,
+        inactividad_segundos=configuracion.sesiones_inactividad_segundos,
+        limite_bytes=configuracion.sesiones_memoria_mb * 1024 * 1024
+    )
+
+# Frases que se repiten en cada sesión: se sintetizan al arrancar
+frases_frecuentes = [
+    f"¡Hola! Soy {nombre_asistente}, tu asistente virtual. ¿Cómo te llamas?",
+    "¿En qué puedo ayudarte hoy?",
+    nucleo.RESPUESTA_ERROR,
+    *nucleo.CONFIRMACIONES_COMANDOS
+]
 
 # Configuración de assets
 avatar_quieto_gif = os.path.join(script_dir, "assets", "avatar_quieto.gif")
@@ -92,153 +125,453 @@ class Estado:
     GRABANDO = 1
     HABLANDO = 2
 
+class WorkerCargaModelo(QThread):
+    listo = pyqtSignal(object)
+    error = pyqtSignal(str)
+    
+    def __init__(self, nombre_backend, nombre_modelo, compute_type):
+        super().__init__()
+        self.nombre_backend = nombre_backend
+        self.nombre_modelo = nombre_modelo
+        self.compute_type = compute_type
+    
+    def run(self):
+        try:
+            if configuracion.asr_procesos > 0:
+                # En procesos aparte la decodificación no compite por el GIL con la interfaz
+                backend = ServicioASRProcesos(self.nombre_backend, self.nombre_modelo, self.compute_type,
+                                              procesos=configuracion.asr_procesos,
+                                              max_segundos=configuracion.vad_max_segundos + 5,
+                                              samplerate=configuracion.asr_samplerate)
+            else:
+                backend = crear_backend_asr(self.nombre_backend, self.nombre_modelo, self.compute_type)
+            backend.cargar()
+            perfil_arranque.marcar(f"importar {self.nombre_backend}", backend.tiempos.get("importar"))
+            perfil_arranque.marcar(f"cargar modelo ASR '{self.nombre_modelo}'", backend.tiempos.get("cargar"))
+            self.listo.emit(backend)
+        except Exception as e:
+            logging.critical(f"Error cargando modelo ASR: {str(e)}", exc_info=True)
+            self.error.emit(str(e))
+
 class WorkerGrabacion(QThread):
     finished = pyqtSignal(str)
     update_status = pyqtSignal(str)
+    parcial = pyqtSignal(str, str)
     
-    def __init__(self, whisper_model, temp_audio_path):
+    def __init__(self, backend_asr, temp_audio_path, audio_previo=None, captura=None, desde=None):
         super().__init__()
-        self.whisper_model = whisper_model
+        self.backend_asr = backend_asr
         self.temp_audio_path = temp_audio_path
+        self.audio_previo = audio_previo
+        self.captura = captura
+        self.desde = desde
+        # Con ASR en procesos cada grabación usa su propio cliente, que se puede cancelar
+        self.cliente_asr = backend_asr.cliente() if hasattr(backend_asr, "cliente") else backend_asr
+        self.transcriptor = nucleo.crear_transcriptor(self.cliente_asr)
         self._is_running = True
+        self._bloques = []
+        self._lock_bloques = threading.Lock()
     
     def run(self):
         try:
-            samplerate = 44100
-            duration = 15
-            
-            self.update_status.emit(f"Grabando... {duration}s")
-            audio = sd.rec(int(duration * samplerate), 
-                         samplerate=samplerate, 
-                         channels=1,
-                         dtype='float32')
+            samplerate = configuracion.asr_samplerate
+            audio = self.capturar(samplerate)
             
-            for i in range(duration, 0, -1):
-                if not self._is_running:
-                    return
-                self.update_status.emit(f"Grabando... {i}s")
-                time.sleep(1)
+            if audio is None or not self._is_running:
+                self.finished.emit("")
+                return
             
-            sd.wait()
-            audio = self.mejorar_calidad_audio(audio, samplerate)
-            
-            try:
-                sf.write(self.temp_audio_path, audio, samplerate)
-                if not os.path.exists(self.temp_audio_path):
-                    raise RuntimeError(f"Archivo no creado: {self.temp_audio_path}")
-                logging.info(f"Archivo de audio creado: {self.temp_audio_path} ({os.path.getsize(self.temp_audio_path)} bytes)")
-            except Exception as e:
-                logging.error(f"Error al guardar audio: {str(e)}")
-                raise
+            if configuracion.guardar_wav_debug:
+                try:
+                    import soundfile as sf
+                    sf.write(self.temp_audio_path, audio, samplerate)
+                    logging.debug(f"Audio de depuración guardado: {self.temp_audio_path}")
+                except Exception as e:
+                    logging.error(f"Error al guardar audio: {str(e)}")
             
-            texto = self.transcribir_audio()
+            texto = self.transcribir_audio(audio)
             self.finished.emit(texto)
         except Exception as e:
             logging.error(f"Error en grabación: {str(e)}", exc_info=True)
             self.finished.emit("")
     
-    def mejorar_calidad_audio(self, audio, samplerate):
+    def capturar(self, samplerate):
+        detector = nucleo.crear_detector(samplerate)
+        
+        fin_captura = threading.Event()
+        hilo_parcial = None
+        if configuracion.asr_parcial:
+            hilo_parcial = threading.Thread(target=self.transcribir_parcial, args=(fin_captura, detector),
+                                            daemon=True)
+            hilo_parcial.start()
+        
+        self.update_status.emit("Escuchando...")
         try:
-            if audio.ndim > 1:
-                audio = np.mean(audio, axis=1)
-            audio = audio / np.max(np.abs(audio))
-            audio = np.convolve(audio, np.ones(5)/5, mode='same')
-            return audio
-        except Exception as e:
-            logging.error(f"Error al mejorar audio: {e}")
-            return audio
+            audio = grabar_hasta_silencio(
+                detector,
+                frontend=FrontendAudio(samplerate),
+                max_segundos=configuracion.vad_max_segundos,
+                espera_segundos=configuracion.vad_espera_segundos,
+                preroll_ms=configuracion.vad_preroll_ms,
+                debe_continuar=lambda: self._is_running,
+                on_bloque=self.acumular_bloque,
+                audio_previo=self.audio_previo,
+                captura=self.captura,
+                desde=self.desde
+            )
+        finally:
+            fin_captura.set()
+            if hilo_parcial:
+                hilo_parcial.join()
+        
+        # Un chasquido o un golpe pueden disparar el VAD: sin voz suficiente no se decodifica
+        # (el audio previo de una interrupción ya fue validado como voz)
+        if audio is not None and self.audio_previo is None and not nucleo.hay_voz(detector):
+            logging.info(f"Turno vacío: {detector.segundos_voz:.2f}s de voz, se omite la transcripción")
+            return None
+        return audio
     
-    def transcribir_audio(self):
+    def acumular_bloque(self, bloque):
+        with self._lock_bloques:
+            self._bloques.append(bloque)
+    
+    def transcribir_parcial(self, fin_captura, detector):
+        intervalo = configuracion.asr_parcial_intervalo_ms / 1000
+        while not fin_captura.wait(intervalo):
+            # La misma puerta que la decodificación final: sin voz suficiente Whisper solo alucina
+            if self.audio_previo is None and not nucleo.hay_voz(detector):
+                continue
+            with self._lock_bloques:
+                if not self._bloques:
+                    continue
+                audio = np.concatenate(self._bloques)
+            try:
+                estable, provisional = self.transcriptor.actualizar(audio)
+            except ASRCancelado:
+                return
+            except Exception as e:
+                logging.error(f"Error en transcripción parcial: {str(e)}", exc_info=True)
+                return
+            if not fin_captura.is_set():
+                self.parcial.emit(estable, provisional)
+    
+    def transcribir_audio(self, audio):
         try:
-            abs_path = os.path.abspath(self.temp_audio_path)
-            if not os.path.exists(abs_path):
-                logging.error(f"ARCHIVO NO ENCONTRADO: {abs_path}")
-                logging.error(f"CONTENIDO DEL DIRECTORIO: {os.listdir(os.path.dirname(abs_path))}")
-                return ""
-            
-            resultado = self.whisper_model.transcribe(
-                rf"{abs_path}",
-                language="spanish",
-                task="transcribe",
-                fp16=False,
-                temperature=0.2,
-                best_of=3,
-                beam_size=5
-            )
-            
-            texto = resultado["text"].strip()
-            texto = self.limpiar_texto_transcrito(texto)
-            return texto
+            # El backend acepta directamente float32 mono a 16 kHz: sin WAV ni ffmpeg;
+            # si hubo parciales, solo se decodifica la cola aún sin confirmar
+            return nucleo.transcribir(self.transcriptor, audio)
+        except ASRCancelado:
+            logging.info("Transcripción cancelada")
+            return ""
         except Exception as e:
             logging.error(f"Error al transcribir: {str(e)}", exc_info=True)
             return ""
     
-    def limpiar_texto_transcrito(self, texto):
-        palabras_confusas = ["喝水", "thereel", "谢谢", "gracias", "thank you"]
-        return ' '.join([palabra for palabra in texto.split() if palabra.lower() not in palabras_confusas]).capitalize()
-    
     def stop(self):
+        """La captura para en el siguiente bloque; la decodificación en curso se cancela si el
+        backend lo permite (ASR en procesos) y si no, se deja terminar"""
         self._is_running = False
-        self.terminate()
+        if hasattr(self.cliente_asr, "cancelar"):
+            self.cliente_asr.cancelar()
 
 class WorkerHablar(QThread):
     finished = pyqtSignal()
+    reproduciendo = pyqtSignal()
     
-    def __init__(self, texto, temp_audio_dir):
+    def __init__(self, motor_tts, salida, texto=None, prioridad=PRIORIDAD_NORMAL, interrumpir=False):
         super().__init__()
-        self.texto = texto
-        self.temp_audio_dir = temp_audio_dir
+        self.motor_tts = motor_tts
+        self.salida = salida
+        self.prioridad = prioridad
+        self.interrumpir = interrumpir
+        self.frases = queue.Queue()
+        # La síntesis se adelanta como mucho unas pocas frases a la reproducción
+        self._huecos = threading.Semaphore(configuracion.tts_cola_max)
+        self._lock = threading.Lock()
+        self._en_cola = 0
+        self._entrada_cerrada = False
+        self._primera = True
+        self._terminado = threading.Event()
+        self._cancelado = threading.Event()
+        if texto:
+            for frase in segmentar_texto(texto):
+                self.encolar(frase)
+            self.terminar_entrada()
+    
+    def encolar(self, frase):
+        self.frases.put(frase)
+    
+    def terminar_entrada(self):
+        self.frases.put(None)
+    
+    def cancelar(self):
+        self._cancelado.set()
+        self.frases.put(None)
+        self.salida.cancelar_turno(self)
+        self._terminado.set()
+    
+    def al_iniciar(self, enunciado):
+        if self._primera:
+            self._primera = False
+            self.reproduciendo.emit()
+    
+    def al_terminar(self, enunciado, cancelado):
+        self._huecos.release()
+        with self._lock:
+            self._en_cola -= 1
+            if self._entrada_cerrada and self._en_cola == 0:
+                self._terminado.set()
     
     def run(self):
-        temp_tts_path = None
         try:
-            os.makedirs(self.temp_audio_dir, exist_ok=True)
-            temp_tts_path = os.path.join(self.temp_audio_dir, f"respuesta_{uuid.uuid4()}.mp3")
-            
-            tts = gTTS(text=self.texto, lang="es", slow=False)
-            tts.save(temp_tts_path)
-            
-            if not os.path.exists(temp_tts_path):
-                raise FileNotFoundError(f"Archivo de audio no generado: {temp_tts_path}")
-            
-            pygame.mixer.music.load(temp_tts_path.replace("\\", "/"))
-            pygame.mixer.music.play()
-            
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
-            
-            pygame.mixer.music.stop()
-            pygame.mixer.music.unload()
+            while not self._cancelado.is_set():
+                frase = self.frases.get()
+                if frase is None:
+                    break
+                try:
+                    # Se decodifica una sola vez a PCM en memoria, sin archivos temporales
+                    resultado = self.motor_tts.sintetizar(frase)
+                    pcm = self.salida.preparar(*decodificar_audio(resultado.audio))
+                except Exception as e:
+                    logging.error(f"ERROR en síntesis: {str(e)}", exc_info=True)
+                    continue
+                
+                self._huecos.acquire()
+                if self._cancelado.is_set():
+                    break
+                with self._lock:
+                    self._en_cola += 1
+                self.salida.encolar(
+                    pcm,
+                    prioridad=self.prioridad,
+                    turno=self,
+                    interrumpir=self.interrumpir,
+                    on_inicio=self.al_iniciar,
+                    on_fin=self.al_terminar
+                )
+                self.interrumpir = False
             
+            with self._lock:
+                self._entrada_cerrada = True
+                if self._en_cola == 0:
+                    self._terminado.set()
+            # El fin lo notifica el callback del stream, sin sondeo
+            self._terminado.wait()
         except Exception as e:
             logging.error(f"ERROR en reproducción: {str(e)}", exc_info=True)
         finally:
-            if temp_tts_path and os.path.exists(temp_tts_path):
-                try:
-                    pygame.time.wait(500)
-                    os.remove(temp_tts_path)
-                except Exception as e:
-                    logging.error(f"Error eliminando archivo temporal: {str(e)}")
             self.finished.emit()
 
+class WorkerInterrupcion(QThread):
+    interrupcion = pyqtSignal(object)
+    
+    def __init__(self, salida, captura=None):
+        super().__init__()
+        self.salida = salida
+        self.captura = captura
+        self._is_running = True
+    
+    def run(self):
+        try:
+            detector = DetectorVoz(
+                configuracion.asr_samplerate,
+                bloque_ms=configuracion.vad_bloque_ms,
+                umbral_db=configuracion.vad_umbral_db,
+                umbral_min_dbfs=configuracion.vad_umbral_min_dbfs
+            )
+            # La salida se corta en este mismo hilo, sin esperar al bucle de Qt
+            inicio = esperar_interrupcion(
+                detector,
+                self.salida.nivel_referencia,
+                margen_db=configuracion.barge_in_margen_db,
+                inicio_ms=configuracion.barge_in_inicio_ms,
+                preroll_ms=configuracion.barge_in_preroll_ms,
+                debe_continuar=lambda: self._is_running,
+                on_deteccion=self.salida.detener,
+                captura=self.captura
+            )
+            if inicio is not None and self._is_running:
+                self.interrupcion.emit(inicio)
+        except Exception as e:
+            logging.error(f"Error vigilando interrupciones: {str(e)}", exc_info=True)
+    
+    def stop(self):
+        self._is_running = False
+
+class WorkerPalabraClave(QThread):
+    detectada = pyqtSignal(object)
+    error = pyqtSignal(str)
+    
+    def __init__(self, backend_asr, captura):
+        super().__init__()
+        self.backend_asr = backend_asr
+        self.captura = captura
+        self.escucha = None
+        self._activa = True
+        self._is_running = True
+    
+    def run(self):
+        try:
+            detector_clave = DetectorPalabraClave.desde_directorio(
+                configuracion.palabra_clave_plantillas_dir,
+                configuracion.asr_samplerate,
+                configuracion.palabra_clave_umbral,
+                sintetizar=lambda texto: decodificar_audio(motor_tts.sintetizar(texto).audio),
+                palabra=configuracion.palabra_clave
+            )
+            verificar = None
+            if configuracion.palabra_clave_verificar_asr:
+                verificar = crear_verificador_asr(self.backend_asr, configuracion.palabra_clave)
+            self.escucha = EscuchaPalabraClave(
+                detector_clave,
+                nucleo.crear_detector(),
+                preroll_ms=configuracion.vad_preroll_ms,
+                verificar=verificar
+            )
+            self.activar(self._activa)
+            self.escucha.ejecutar(self.captura, self.detectada.emit, debe_continuar=lambda: self._is_running)
+        except Exception as e:
+            logging.error(f"Error en la escucha de la palabra clave: {str(e)}", exc_info=True)
+            self.error.emit(str(e))
+    
+    def activar(self, activa):
+        """Fuera de reposo (grabando o hablando) no se busca la palabra clave"""
+        self._activa = activa
+        if self.escucha is not None:
+            if activa:
+                self.escucha.activa.set()
+            else:
+                self.escucha.activa.clear()
+    
+    def stop(self):
+        self._is_running = False
+
+class WorkerLLM(QThread):
+    token = pyqtSignal(str)
+    finished = pyqtSignal(str)
+    
+    def __init__(self, mensajes, model_name, texto=None, contexto=None):
+        super().__init__()
+        self.mensajes = mensajes
+        self.model_name = model_name
+        # La caché de respuestas usa SQLite: se consulta y se actualiza aquí, fuera del hilo de Qt
+        self.texto = texto
+        self.contexto = contexto
+        self.usar_cache = cache_respuestas is not None and contexto is not None
+        self.cacheada = False
+        self.metricas = {}
+        self._cancelado = False
+    
+    def run(self):
+        if self.usar_cache:
+            respuesta = cache_respuestas.obtener(self.texto, **self.contexto)
+            if respuesta:
+                self.cacheada = True
+                self.finished.emit(respuesta)
+                return
+        partes = []
+        inicio = time.perf_counter()
+        try:
+            for texto in nucleo.generar_tokens(self.mensajes, self.model_name, lambda: self._cancelado,
+                                               self.metricas):
+                partes.append(texto)
+                self.token.emit(texto)
+            respuesta = "".join(partes).strip()
+        except Exception as e:
+            logging.error(f"Error al generar respuesta: {e}")
+            respuesta = "".join(partes).strip() or nucleo.RESPUESTA_ERROR
+        logging.info(f"Respuesta completa en {time.perf_counter() - inicio:.2f}s")
+        # Solo las respuestas completas del modelo pasan a la caché
+        if self.usar_cache and self.metricas and not self._cancelado:
+            cache_respuestas.guardar(self.texto, respuesta, self.metricas["segundos"], **self.contexto)
+        self.finished.emit(respuesta)
+    
+    def cancelar(self):
+        self._cancelado = True
+
 class AsistenteVirtualGUI(QMainWindow):
     def __init__(self):
         super().__init__()
         self.nombre_asistente = nombre_asistente
-        self.nombre_usuario = nombre_usuario
+        self.sesion = sesiones.crear(nombre_usuario)
         self.estado_actual = Estado.QUIETO
-        self.conversacion = []
+        self.tokens_pendientes = []
+        self.respuesta_stream = []
+        self.workers_cancelados = []
+        self.segmentador = SegmentadorFrases()
+        self.backend_asr = None
+        self.worker_palabra_clave = None
+        self.ventana_mostrada = False
+        
+        # Los tokens se acumulan y se vuelcan a la vista a una tasa fija
+        self.temporizador_tokens = QTimer(self)
+        self.temporizador_tokens.setInterval(int(1000 / configuracion.gui_fps))
+        self.temporizador_tokens.timeout.connect(self.volcar_tokens)
         
-        pygame.init()
-        pygame.mixer.init()
+        salida.abrir()
+        if configuracion.captura_persistente:
+            self.captura_compartida()
         
         self.setWindowTitle(f"Asistente Virtual {self.nombre_asistente}")
         self.setGeometry(100, 100, 1000, 700)
         self.setup_ui()
         
+        # La grabación se habilita cuando el modelo esté listo; el chat escrito funciona ya
+        self.grabar_button.setEnabled(False)
+        self.grabar_button.setText("Cargando voz...")
+        self.worker_carga = WorkerCargaModelo(configuracion.asr_backend, configuracion.asr_modelo,
+                                              configuracion.asr_compute_type)
+        self.worker_carga.listo.connect(self.modelo_listo)
+        self.worker_carga.error.connect(self.modelo_fallido)
+        self.worker_carga.start()
+        
+        # El LLM se carga en Ollama mientras tanto y se mantiene caliente mientras se use la ventana
+        self.mantenedor_llm = nucleo.MantenedorLLM(
+            model_name,
+            configuracion.llm_keep_alive,
+            configuracion.llm_ping_segundos,
+            hay_actividad=lambda: time.monotonic() - self.sesion.ultimo_uso < configuracion.sesiones_inactividad_segundos
+        )
+        self.mantenedor_llm.iniciar(on_listo=lambda segundos: perfil_arranque.marcar("LLM precargado", segundos))
+        
         mensaje_inicial = f"{self.nombre_asistente}: ¡Hola! Soy {self.nombre_asistente}, tu asistente virtual. ¿Cómo te llamas?"
         self.agregar_mensaje(mensaje_inicial)
         self.hablar(mensaje_inicial.split(": ")[1])
+        motor_tts.calentar(frases_frecuentes)
+    
+    @property
+    def nombre_usuario(self):
+        return self.sesion.conversacion.nombre_usuario
+    
+    @nombre_usuario.setter
+    def nombre_usuario(self, nombre):
+        self.sesion.conversacion.nombre_usuario = nombre
+    
+    @property
+    def conversacion(self):
+        return self.sesion.conversacion.mensajes
+    
+    def al_mostrar_ventana(self):
+        self.ventana_mostrada = True
+        perfil_arranque.marcar("primera ventana")
+        if self.backend_asr is not None:
+            perfil_arranque.informe()
+    
+    def modelo_listo(self, backend):
+        self.backend_asr = backend
+        perfil_arranque.marcar("reconocimiento de voz listo")
+        if self.ventana_mostrada:
+            perfil_arranque.informe()
+        if not (hasattr(self, 'worker_grabacion') and self.worker_grabacion.isRunning()):
+            self.grabar_button.setEnabled(True)
+            self.grabar_button.setText("Grabar Audio")
+        self.manos_libres_button.setEnabled(True)
+        if configuracion.manos_libres:
+            self.manos_libres_button.setChecked(True)
+    
+    def modelo_fallido(self, mensaje):
+        self.grabar_button.setText("Voz no disponible")
+        perfil_arranque.informe()
     
     def setup_ui(self):
         central_widget = QWidget()
@@ -271,9 +604,17 @@ class AsistenteVirtualGUI(QMainWindow):
         self.grabar_button.setIcon(QIcon.fromTheme("microphone"))
         self.grabar_button.setIconSize(QSize(24, 24))
         self.grabar_button.setFixedHeight(40)
-        self.grabar_button.clicked.connect(self.iniciar_grabacion)
+        self.grabar_button.clicked.connect(lambda: self.iniciar_grabacion())
         
         left_column.addWidget(self.grabar_button)
+        
+        self.manos_libres_button = QPushButton(f"Manos libres (di \"{configuracion.palabra_clave}\")")
+        self.manos_libres_button.setCheckable(True)
+        self.manos_libres_button.setEnabled(False)
+        self.manos_libres_button.setFixedHeight(40)
+        self.manos_libres_button.toggled.connect(self.cambiar_manos_libres)
+        
+        left_column.addWidget(self.manos_libres_button)
         left_column.addStretch()
         
         right_column = QVBoxLayout()
@@ -310,6 +651,18 @@ class AsistenteVirtualGUI(QMainWindow):
         scroll_area.setStyleSheet("border: none;")
         right_column.addWidget(scroll_area)
         
+        self.parcial_label = QLabel()
+        self.parcial_label.setWordWrap(True)
+        self.parcial_label.setStyleSheet("""
+            QLabel {
+                font-size: 13px;
+                color: #27ae60;
+                padding: 0 5px;
+            }
+        """)
+        self.parcial_label.hide()
+        right_column.addWidget(self.parcial_label)
+        
         self.input_line = QLineEdit()
         self.input_line.setPlaceholderText("Escribe tu mensaje aquí...")
         self.input_line.setStyleSheet("""
@@ -397,14 +750,16 @@ class AsistenteVirtualGUI(QMainWindow):
             self.avatar_label.setPixmap(pixmap)
     
     def cambiar_estado_avatar(self, estado):
+        self.estado_actual = estado
+        if self.worker_palabra_clave is not None:
+            self.worker_palabra_clave.activar(estado == Estado.QUIETO)
         if estado == Estado.QUIETO:
             self.cargar_avatar(avatar_quieto_gif)
         elif estado in (Estado.GRABANDO, Estado.HABLANDO):
             self.cargar_avatar(avatar_hablando_gif)
     
     def agregar_mensaje(self, mensaje):
-        self.conversacion.append(mensaje)
-        self.guardar_conversacion(mensaje)
+        self.sesion.agregar_mensaje(mensaje)
         
         cursor = self.conversacion_text.textCursor()
         cursor.movePosition(QTextCursor.End)
@@ -430,133 +785,270 @@ class AsistenteVirtualGUI(QMainWindow):
         self.conversacion_text.verticalScrollBar().setValue(
             self.conversacion_text.verticalScrollBar().maximum())
     
-    def guardar_conversacion(self, mensaje):
-        try:
-            with open(conversacion_path, "a", encoding="utf-8") as archivo:
-                archivo.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {mensaje}\n")
-        except Exception as e:
-            logging.error(f"Error al guardar conversación: {e}")
-    
     def enviar_mensaje(self):
         texto = self.input_line.text().strip()
         if texto:
             self.agregar_mensaje(f"Tú: {texto}")
             self.input_line.clear()
-            
-            respuesta = self.generar_respuesta(texto)
-            self.agregar_mensaje(f"{self.nombre_asistente}: {respuesta}")
-            self.hablar(respuesta)
-            
-            self.ejecutar_comando(texto)
+            self.generar_respuesta(texto)
     
-    def iniciar_grabacion(self):
+    def iniciar_grabacion(self, audio_previo=None, desde=None):
         if hasattr(self, 'worker_grabacion') and self.worker_grabacion.isRunning():
             return
+        if self.backend_asr is None:
+            return
         
+        self.cancelar_respuesta()
+        self.detener_habla()
         self.cambiar_estado_avatar(Estado.GRABANDO)
         self.grabar_button.setEnabled(False)
         self.grabar_button.setText("Grabando...")
         
-        self.worker_grabacion = WorkerGrabacion(whisper_model, temp_audio_path)
+        self.worker_grabacion = WorkerGrabacion(self.backend_asr, self.sesion.ruta_temporal("grabacion.wav"),
+                                                audio_previo, microfono if microfono.abierto else None, desde)
         self.worker_grabacion.finished.connect(self.finalizar_grabacion)
         self.worker_grabacion.update_status.connect(
             lambda msg: self.agregar_mensaje(f"{self.nombre_asistente}: {msg}"))
+        self.worker_grabacion.parcial.connect(self.mostrar_parcial)
         self.worker_grabacion.start()
     
+    def captura_compartida(self):
+        """Micrófono persistente abierto, o None si no se pudo abrir"""
+        if not microfono.abierto:
+            try:
+                microfono.abrir()
+            except Exception as e:
+                logging.error(f"No se pudo abrir el micrófono persistente: {str(e)}")
+                return None
+        return microfono
+    
+    def cambiar_manos_libres(self, activo):
+        if activo and self.worker_palabra_clave is None:
+            captura = self.captura_compartida()
+            if captura is None:
+                self.manos_libres_button.setChecked(False)
+                return
+            self.worker_palabra_clave = WorkerPalabraClave(self.backend_asr, captura)
+            self.worker_palabra_clave.activar(self.estado_actual == Estado.QUIETO)
+            self.worker_palabra_clave.detectada.connect(self.palabra_clave_detectada)
+            self.worker_palabra_clave.error.connect(lambda _: self.manos_libres_button.setChecked(False))
+            self.worker_palabra_clave.start()
+        elif not activo and self.worker_palabra_clave is not None:
+            self.worker_palabra_clave.stop()
+            self.conservar_hasta_terminar(self.worker_palabra_clave)
+            self.worker_palabra_clave = None
+    
+    def palabra_clave_detectada(self, posicion):
+        # El turno se graba desde el final de la palabra clave, aunque ya haya pasado:
+        # lo dicho mientras tanto sigue en el buffer de la captura
+        if self.estado_actual == Estado.QUIETO:
+            self.iniciar_grabacion(desde=posicion)
+    
+    def mostrar_parcial(self, estable, provisional):
+        self.parcial_label.setText(
+            f"<b>Tú:</b> {html.escape(estable)} "
+            f"<span style='color: #95a5a6;'><i>{html.escape(provisional)}</i></span>")
+        self.parcial_label.show()
+    
     def finalizar_grabacion(self, texto):
+        self.parcial_label.clear()
+        self.parcial_label.hide()
         self.grabar_button.setEnabled(True)
         self.grabar_button.setText("Grabar Audio")
         self.cambiar_estado_avatar(Estado.QUIETO)
         
         if texto:
             self.agregar_mensaje(f"Tú: {texto}")
-            
-            respuesta = self.generar_respuesta(texto)
+            self.generar_respuesta(texto)
+    
+    def generar_respuesta(self, texto):
+        self.cancelar_respuesta()
+        
+        # Las órdenes se resuelven antes que el LLM y no pasan por él
+        respuesta = self.ejecutar_comando(texto) or self.detectar_nombre(texto)
+        if respuesta:
             self.agregar_mensaje(f"{self.nombre_asistente}: {respuesta}")
             self.hablar(respuesta)
-            
-            self.ejecutar_comando(texto)
+            return
+        
+        # El contexto se fija ahora, antes de que este turno entre en el historial
+        contexto = self.sesion.conversacion.contexto_cache(texto)
+        self.iniciar_mensaje_stream()
+        self.iniciar_habla()
+        self.worker_llm = WorkerLLM(self.sesion.conversacion.mensajes_chat(texto), model_name, texto, contexto)
+        self.worker_llm.token.connect(self.recibir_token)
+        self.worker_llm.finished.connect(lambda respuesta: self.respuesta_completa(texto, respuesta))
+        self.worker_llm.start()
     
-    def generar_respuesta(self, texto):
-        texto_lower = texto.lower()
-        
-        if self.nombre_usuario is None:
-            if "me llamo" in texto_lower:
-                self.nombre_usuario = texto_lower.split("me llamo")[-1].strip().title()
-            elif "mi nombre es" in texto_lower:
-                self.nombre_usuario = texto_lower.split("mi nombre es")[-1].strip().title()
-            elif "soy" in texto_lower:
-                self.nombre_usuario = texto_lower.split("soy")[-1].strip().title()
-            
-            if self.nombre_usuario and len(self.nombre_usuario) > 1:
-                respuesta = f"¡Mucho gusto, {self.nombre_usuario}! ¿En qué puedo ayudarte hoy?"
-                logging.info(f"Nombre detectado: {self.nombre_usuario}")
-                return respuesta
-        
-        prompt = (
-            f"Eres {self.nombre_asistente}, un asistente virtual en español. "
-            f"{f'El usuario {self.nombre_usuario} te dice:' if self.nombre_usuario else 'Usuario:'} {texto}\n"
-            f"Responde de manera clara y concisa en español (máximo 50 palabras):"
-        )
+    def detectar_nombre(self, texto):
+        self.nombre_usuario, respuesta = nucleo.detectar_nombre(texto, self.nombre_usuario)
+        return respuesta
+    
+    def iniciar_mensaje_stream(self):
+        self.tokens_pendientes.clear()
+        self.respuesta_stream = []
         
-        try:
-            respuesta = ollama.generate(
-                model=model_name,
-                prompt=prompt,
-                options={"max_tokens": 50}
-            )
-            return respuesta["response"]
-        except Exception as e:
-            logging.error(f"Error al generar respuesta: {e}")
-            return "Lo siento, no pude procesar tu solicitud."
+        cursor = self.conversacion_text.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        if self.conversacion_text.toPlainText():
+            cursor.insertHtml("<hr style='margin: 10px 0; border: 1px solid #eee;'>")
+        cursor.insertHtml(f"<div style='color: #2c3e50; margin: 5px 0;'><b>{self.nombre_asistente}:</b></div>")
+        self.insertar_texto_stream(" ")
+        self.temporizador_tokens.start()
+    
+    def insertar_texto_stream(self, texto):
+        formato = QTextCharFormat()
+        formato.setForeground(QColor("#2c3e50"))
+        cursor = self.conversacion_text.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(texto, formato)
+        self.conversacion_text.verticalScrollBar().setValue(
+            self.conversacion_text.verticalScrollBar().maximum())
+    
+    def recibir_token(self, token):
+        self.tokens_pendientes.append(token)
+        for frase in self.segmentador.agregar(token):
+            self.worker_hablar.encolar(frase)
+    
+    def volcar_tokens(self):
+        if not self.tokens_pendientes:
+            return
+        texto = "".join(self.tokens_pendientes)
+        self.tokens_pendientes.clear()
+        self.respuesta_stream.append(texto)
+        self.insertar_texto_stream(texto)
+    
+    def cerrar_mensaje_stream(self, respuesta):
+        self.temporizador_tokens.stop()
+        self.volcar_tokens()
+        if not self.respuesta_stream:
+            self.insertar_texto_stream(respuesta)
+        if respuesta:
+            mensaje = f"{self.nombre_asistente}: {respuesta}"
+            self.sesion.agregar_mensaje(mensaje)
+    
+    def respuesta_completa(self, texto, respuesta):
+        self.cerrar_mensaje_stream(respuesta)
+        # Solo las respuestas completas (del modelo o de la caché) pasan a la memoria de la conversación
+        if self.worker_llm.cacheada:
+            self.sesion.conversacion.registrar_turno(texto, respuesta)
+        elif self.worker_llm.metricas:
+            self.sesion.conversacion.registrar_turno(texto, respuesta, self.worker_llm.metricas)
+        frases = self.segmentador.vaciar() if self.respuesta_stream else segmentar_texto(respuesta)
+        for frase in frases:
+            self.worker_hablar.encolar(frase)
+        self.worker_hablar.terminar_entrada()
+    
+    def cancelar_respuesta(self):
+        if not hasattr(self, 'worker_llm') or not self.worker_llm.isRunning():
+            return
+        self.worker_llm.token.disconnect()
+        self.worker_llm.finished.disconnect()
+        self.worker_llm.cancelar()
+        self.conservar_hasta_terminar(self.worker_llm)
+        self.cerrar_mensaje_stream("".join(self.respuesta_stream + self.tokens_pendientes).strip())
+        self.detener_habla()
+    
+    def conservar_hasta_terminar(self, worker):
+        # Se conserva la referencia hasta que el hilo termine de cerrar sus recursos
+        self.workers_cancelados = [w for w in self.workers_cancelados if w.isRunning()]
+        self.workers_cancelados.append(worker)
     
     def hablar(self, texto):
-        self.cambiar_estado_avatar(Estado.HABLANDO)
+        self.iniciar_habla(texto)
+    
+    def iniciar_habla(self, texto=None):
+        self.detener_habla()
+        self.segmentador.reiniciar()
         
-        self.worker_hablar = WorkerHablar(texto, temp_audio_dir)
-        self.worker_hablar.finished.connect(
-            lambda: self.cambiar_estado_avatar(Estado.QUIETO))
+        self.worker_hablar = WorkerHablar(motor_tts, salida, texto, interrumpir=True)
+        self.worker_hablar.reproduciendo.connect(self.al_empezar_a_hablar)
+        self.worker_hablar.finished.connect(self.al_terminar_de_hablar)
         self.worker_hablar.start()
     
+    def detener_habla(self):
+        self.detener_monitor_interrupcion()
+        if not hasattr(self, 'worker_hablar') or not self.worker_hablar.isRunning():
+            return
+        self.worker_hablar.reproduciendo.disconnect()
+        self.worker_hablar.finished.disconnect()
+        self.worker_hablar.cancelar()
+        self.conservar_hasta_terminar(self.worker_hablar)
+        self.cambiar_estado_avatar(Estado.QUIETO)
+    
+    def al_empezar_a_hablar(self):
+        self.cambiar_estado_avatar(Estado.HABLANDO)
+        self.iniciar_monitor_interrupcion()
+    
+    def al_terminar_de_hablar(self):
+        self.cambiar_estado_avatar(Estado.QUIETO)
+        self.detener_monitor_interrupcion()
+    
+    def iniciar_monitor_interrupcion(self):
+        # Sin modelo ASR la interrupción cortaría al asistente sin poder grabar al usuario
+        if not configuracion.barge_in or self.backend_asr is None:
+            return
+        if hasattr(self, 'worker_interrupcion') and self.worker_interrupcion.isRunning():
+            return
+        self.worker_interrupcion = WorkerInterrupcion(salida, microfono if microfono.abierto else None)
+        self.worker_interrupcion.interrupcion.connect(self.interrumpir)
+        self.worker_interrupcion.start()
+    
+    def detener_monitor_interrupcion(self):
+        if not hasattr(self, 'worker_interrupcion') or not self.worker_interrupcion.isRunning():
+            return
+        self.worker_interrupcion.interrupcion.disconnect()
+        self.worker_interrupcion.stop()
+        self.conservar_hasta_terminar(self.worker_interrupcion)
+    
+    def interrumpir(self, inicio):
+        logging.info("El usuario interrumpe: se cancela la respuesta en curso")
+        # iniciar_grabacion cancela el stream del LLM y la síntesis pendiente. Con el micrófono
+        # compartido llega la posición en que empezó a hablar; si no, una copia de su voz
+        if isinstance(inicio, np.ndarray):
+            self.iniciar_grabacion(audio_previo=inicio)
+        else:
+            self.iniciar_grabacion(desde=inicio)
+    
     def ejecutar_comando(self, texto):
-        texto = texto.lower()
-        
-        comandos = {
-            "abrir chrome": lambda: subprocess.Popen("chrome.exe"),
-            "abrir notepad": lambda: subprocess.Popen("notepad.exe"),
-            "abrir calculadora": lambda: subprocess.Popen("calc.exe"),
-            "ir a ": lambda url: webbrowser.open(f"https://{url}" if not url.startswith(("http", "www")) else url),
-            "reproducir ": lambda cancion: webbrowser.open(f"https://www.youtube.com/results?search_query={cancion}")
-        }
-        
-        for cmd, accion in comandos.items():
-            if texto.startswith(cmd):
-                try:
-                    parametro = texto[len(cmd):].strip()
-                    if parametro:
-                        accion(parametro)
-                    else:
-                        accion()
-                    return True
-                except Exception as e:
-                    logging.error(f"Error al ejecutar comando {cmd}: {e}")
-        return False
+        return nucleo.ejecutar_comando(texto, self.nombre_asistente)
     
     def limpiar_conversacion(self):
         self.conversacion_text.clear()
-        self.conversacion = []
+        self.sesion.conversacion.vaciar()
     
     def closeEvent(self, event):
         if hasattr(self, 'worker_grabacion') and self.worker_grabacion.isRunning():
             self.worker_grabacion.stop()
+            self.worker_grabacion.wait()
         
-        if hasattr(self, 'worker_hablar') and self.worker_hablar.isRunning():
-            self.worker_hablar.terminate()
+        self.cancelar_respuesta()
+        self.detener_habla()
+        for worker in self.workers_cancelados:
+            worker.wait(1000)
         
-        pygame.quit()
+        if self.worker_palabra_clave is not None:
+            self.worker_palabra_clave.stop()
+            self.worker_palabra_clave.wait(1000)
+            if self.worker_palabra_clave.escucha is not None:
+                logging.info(f"Estadísticas de palabra clave: {self.worker_palabra_clave.escucha.estadisticas()}")
+        self.mantenedor_llm.detener()
+        logging.info(f"Estadísticas de caché TTS: {cache_tts.estadisticas()}")
+        if cache_respuestas:
+            logging.info(f"Estadísticas de caché de respuestas: {cache_respuestas.estadisticas()}")
+        logging.info(f"Estadísticas del LLM: {self.mantenedor_llm.estadisticas()}")
+        logging.info(f"Estadísticas de salida de audio: {salida.estadisticas()}")
+        salida.cerrar()
+        if isinstance(self.backend_asr, ServicioASRProcesos):
+            logging.info(f"Estadísticas de procesos ASR: {self.backend_asr.estadisticas()}")
+            self.backend_asr.cerrar()
+        if microfono.abierto:
+            logging.info(f"Captura: {microfono.desbordes} desbordes")
+            microfono.cerrar()
         event.accept()
 
 if __name__ == "__main__":
+    inicializar()
     app = QApplication(sys.argv)
     
     font = QFont("Arial", 12)
@@ -579,4 +1071,5 @@ if __name__ == "__main__":
     
     window = AsistenteVirtualGUI()
     window.show()
+    QTimer.singleShot(0, window.al_mostrar_ventana)
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,407 @@
+import abc
+import importlib
+import logging
+import threading
+import time
+
+import numpy as np
+
+
+# Búsqueda en haz determinista. "temperatura" admite también una escalera como (0.0, 0.2, 0.4):
+# el motor solo pasa a muestrear (con best_of) si la haz no supera sus umbrales de calidad
+OPCIONES_FINALES = {
+    "temperatura": 0.0,
+    "beam_size": 5
+}
+
+OPCIONES_VORACES = {
+    "temperatura": 0.0,
+    "beam_size": None
+}
+
+OPCIONES_PARCIALES = {
+    "temperatura": 0.0
+}
+
+
+class SegmentoASR:
+    def __init__(self, inicio, fin, texto, avg_logprob=None, no_speech_prob=None, compression_ratio=None):
+        self.inicio = inicio
+        self.fin = fin
+        self.texto = texto
+        self.avg_logprob = avg_logprob
+        self.no_speech_prob = no_speech_prob
+        self.compression_ratio = compression_ratio
+
+    @property
+    def confianza(self):
+        return float(np.exp(self.avg_logprob)) if self.avg_logprob is not None else None
+
+
+class ResultadoASR:
+    """Resultado común a todos los backends: texto, segmentos, tiempos y confianza"""
+
+    def __init__(self, texto, segmentos, duracion_audio, segundos_decodificacion, backend):
+        self.texto = texto
+        self.segmentos = segmentos
+        self.duracion_audio = duracion_audio
+        self.segundos_decodificacion = segundos_decodificacion
+        self.backend = backend
+        self.nivel = None
+
+    @property
+    def rtf(self):
+        return self.segundos_decodificacion / self.duracion_audio if self.duracion_audio else None
+
+    @property
+    def confianza(self):
+        """Confianza media por token ponderada por la duración de cada segmento"""
+        pares = [(s.confianza, s.fin - s.inicio) for s in self.segmentos if s.confianza is not None]
+        total = sum(duracion for _, duracion in pares)
+        if not total:
+            return None
+        return sum(confianza * duracion for confianza, duracion in pares) / total
+
+
+class BackendASR(abc.ABC):
+    """Interfaz común de los motores de reconocimiento de voz"""
+
+    nombre = "base"
+    modulo = None   # biblioteca del motor; importarla en frío (torch, ctranslate2) es parte del arranque
+
+    def __init__(self, modelo="small", idioma="es", samplerate=16000):
+        self.modelo = modelo
+        self.idioma = idioma
+        self.samplerate = samplerate
+        self.tiempos = {}
+
+    def cargar(self):
+        """Importa el motor y carga el modelo; `tiempos` guarda lo que tardó cada paso"""
+        inicio = time.perf_counter()
+        importlib.import_module(self.modulo)
+        self.tiempos["importar"] = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        self._cargar()
+        self.tiempos["cargar"] = time.perf_counter() - inicio
+        return self
+
+    @abc.abstractmethod
+    def _cargar(self):
+        """Carga el modelo (la biblioteca ya está importada)"""
+
+    @abc.abstractmethod
+    def _transcribir(self, audio, opciones, contexto):
+        """Lista de SegmentoASR de `audio` (float32 mono a `samplerate`)"""
+
+    def transcribir(self, audio, opciones=None, contexto=None):
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        inicio = time.perf_counter()
+        segmentos = self._transcribir(audio, opciones or OPCIONES_FINALES, contexto)
+        texto = " ".join(s.texto for s in segmentos).strip()
+        return ResultadoASR(texto, segmentos, len(audio) / self.samplerate,
+                            time.perf_counter() - inicio, self.nombre)
+
+    def transcribir_lote(self, audios, opciones=None, contexto=None):
+        """Varias grabaciones con las mismas opciones; sin soporte nativo se decodifican de una en una"""
+        return [self.transcribir(audio, opciones, contexto) for audio in audios]
+
+
+class BackendWhisper(BackendASR):
+    """Paquete openai-whisper (PyTorch, fp32 en CPU)"""
+
+    nombre = "whisper"
+    modulo = "whisper"
+
+    def _cargar(self):
+        import whisper
+
+        self._modelo = whisper.load_model(self.modelo)
+        # Cada decodificación instala sus ganchos de caché KV en el modelo: dos a la vez se
+        # pisan, así que se decodifica de una en una (faster-whisper sí admite concurrencia)
+        self._lock = threading.Lock()
+
+    def _transcribir(self, audio, opciones, contexto):
+        argumentos = {"temperature": opciones.get("temperatura", 0.0)}
+        if opciones.get("beam_size"):
+            argumentos["beam_size"] = opciones["beam_size"]
+        if opciones.get("best_of"):
+            argumentos["best_of"] = opciones["best_of"]
+        with self._lock:
+            resultado = self._modelo.transcribe(
+                audio,
+                language=self.idioma,
+                task="transcribe",
+                fp16=False,
+                initial_prompt=contexto,
+                condition_on_previous_text=False,
+                **argumentos
+            )
+        return [
+            SegmentoASR(s["start"], s["end"], s["text"].strip(), s.get("avg_logprob"),
+                        s.get("no_speech_prob"), s.get("compression_ratio"))
+            for s in resultado["segments"]
+        ]
+
+    def transcribir_lote(self, audios, opciones=None, contexto=None):
+        """Rellena cada grabación a 30 s y pasa el lote de espectrogramas por el codificador y el decodificador
+
+        A diferencia de transcribir(), se decodifica sin marcas de tiempo: cada resultado trae un
+        único segmento que abarca toda la grabación, así que el filtro de alucinaciones la acepta
+        o la descarta entera. Con una escalera de temperaturas se decodifica de una en una.
+        """
+        import torch
+        import whisper
+
+        opciones = opciones or OPCIONES_FINALES
+        audios = [np.ascontiguousarray(audio, dtype=np.float32) for audio in audios]
+        temperatura = opciones.get("temperatura", 0.0)
+        # whisper.decode no sabe recorrer una escalera de temperaturas: eso lo hace transcribe()
+        if (len(audios) == 1 or isinstance(temperatura, (tuple, list))
+                or any(len(audio) > whisper.audio.N_SAMPLES for audio in audios)):
+            return super().transcribir_lote(audios, opciones, contexto)
+
+        inicio = time.perf_counter()
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=self._modelo.dims.n_mels)
+            for audio in audios
+        ]).to(self._modelo.device)
+        # whisper.decode no admite best_of en voraz ni beam_size al muestrear
+        decodificacion = whisper.DecodingOptions(
+            task="transcribe",
+            language=self.idioma,
+            temperature=temperatura,
+            best_of=opciones.get("best_of") if temperatura > 0 else None,
+            beam_size=opciones.get("beam_size") if temperatura == 0 else None,
+            prompt=contexto,
+            without_timestamps=True,
+            fp16=False
+        )
+        with self._lock, torch.no_grad():
+            resultados = whisper.decode(self._modelo, mel, decodificacion)
+        segundos = time.perf_counter() - inicio
+
+        salida = []
+        for audio, r in zip(audios, resultados):
+            duracion = len(audio) / self.samplerate
+            texto = r.text.strip()
+            segmentos = [SegmentoASR(0.0, duracion, texto, r.avg_logprob, r.no_speech_prob,
+                                     r.compression_ratio)] if texto else []
+            # Cada grabación espera al lote completo: ese es su tiempo de decodificación
+            salida.append(ResultadoASR(texto, segmentos, duracion, segundos, self.nombre))
+        return salida
+
+
+class BackendFasterWhisper(BackendASR):
+    """faster-whisper (CTranslate2) con cuantización int8 en CPU"""
+
+    nombre = "faster-whisper"
+    modulo = "faster_whisper"
+
+    def __init__(self, modelo="small", idioma="es", samplerate=16000, compute_type="int8",
+                 device="cpu", hilos=0, trabajadores=1):
+        super().__init__(modelo, idioma, samplerate)
+        self.compute_type = compute_type
+        self.device = device
+        self.hilos = hilos
+        self.trabajadores = trabajadores
+
+    def _cargar(self):
+        from faster_whisper import WhisperModel
+
+        self._modelo = WhisperModel(self.modelo, device=self.device, compute_type=self.compute_type,
+                                    cpu_threads=self.hilos, num_workers=self.trabajadores)
+
+    def _transcribir(self, audio, opciones, contexto):
+        segmentos, _ = self._modelo.transcribe(
+            audio,
+            language=self.idioma,
+            task="transcribe",
+            temperature=opciones.get("temperatura", 0.0),
+            beam_size=opciones.get("beam_size") or 1,
+            best_of=opciones.get("best_of") or 1,
+            initial_prompt=contexto,
+            condition_on_previous_text=False
+        )
+        # El generador decodifica de forma perezosa: se consume aquí
+        return [
+            SegmentoASR(s.start, s.end, s.text.strip(), s.avg_logprob, s.no_speech_prob, s.compression_ratio)
+            for s in segmentos
+        ]
+
+
+BACKENDS = {
+    "whisper": BackendWhisper,
+    "faster-whisper": BackendFasterWhisper
+}
+
+
+def crear_backend_asr(nombre, modelo="small", compute_type="int8", idioma="es", trabajadores=1):
+    """trabajadores: decodificaciones concurrentes que admite el modelo (solo faster-whisper)"""
+    if nombre not in BACKENDS:
+        raise ValueError(f"Backend ASR desconocido: {nombre} (opciones: {', '.join(BACKENDS)})")
+    if nombre == "faster-whisper":
+        return BackendFasterWhisper(modelo, idioma, compute_type=compute_type, trabajadores=trabajadores)
+    return BACKENDS[nombre](modelo, idioma)
+
+
+class PoliticaDecodificacion:
+    """Decodifica primero en voraz y repite con búsqueda en haz solo si la hipótesis es dudosa"""
+
+    def __init__(self, umbral_logprob=-0.8, umbral_compresion=2.4, umbral_no_voz=0.5,
+                 opciones_rapidas=None, opciones_precisas=None):
+        self.umbral_logprob = umbral_logprob
+        self.umbral_compresion = umbral_compresion
+        self.umbral_no_voz = umbral_no_voz
+        self.opciones_rapidas = opciones_rapidas or OPCIONES_VORACES
+        self.opciones_precisas = opciones_precisas or OPCIONES_FINALES
+
+    def motivo_reintento(self, resultado):
+        """Primer umbral que cruza algún segmento, o None si la hipótesis voraz es aceptable"""
+        for segmento in resultado.segmentos:
+            if segmento.avg_logprob is not None and segmento.avg_logprob < self.umbral_logprob:
+                return f"avg_logprob {segmento.avg_logprob:.2f} < {self.umbral_logprob}"
+            if segmento.compression_ratio is not None and segmento.compression_ratio > self.umbral_compresion:
+                return f"compression_ratio {segmento.compression_ratio:.2f} > {self.umbral_compresion}"
+            if segmento.no_speech_prob is not None and segmento.no_speech_prob > self.umbral_no_voz:
+                return f"no_speech_prob {segmento.no_speech_prob:.2f} > {self.umbral_no_voz}"
+        return None
+
+    def decodificar(self, backend, audio, contexto=None):
+        resultado = backend.transcribir(audio, self.opciones_rapidas, contexto)
+        resultado.nivel = "voraz"
+        motivo = self.motivo_reintento(resultado)
+        if motivo is None:
+            logging.info(f"ASR nivel voraz: {resultado.segundos_decodificacion:.2f}s "
+                         f"(umbrales logprob {self.umbral_logprob}, compresión {self.umbral_compresion}, "
+                         f"no_voz {self.umbral_no_voz})")
+            return resultado
+
+        voraz = resultado.segundos_decodificacion
+        resultado = backend.transcribir(audio, self.opciones_precisas, contexto)
+        resultado.nivel = "haz"
+        logging.info(f"ASR nivel haz por {motivo}: {voraz:.2f}s voraz + "
+                     f"{resultado.segundos_decodificacion:.2f}s en haz")
+        resultado.segundos_decodificacion += voraz
+        return resultado
+
+
+class FiltroSilencio:
+    """Descarta los segmentos con pinta de alucinación sobre silencio o ruido"""
+
+    def __init__(self, umbral_no_voz=0.6, umbral_logprob=-1.0, umbral_compresion=2.4):
+        self.umbral_no_voz = umbral_no_voz
+        self.umbral_logprob = umbral_logprob
+        self.umbral_compresion = umbral_compresion
+
+    def es_alucinacion(self, segmento):
+        # Misma regla que Whisper para el silencio: probable no-voz y además poca confianza
+        if (segmento.no_speech_prob is not None and segmento.avg_logprob is not None
+                and segmento.no_speech_prob > self.umbral_no_voz
+                and segmento.avg_logprob < self.umbral_logprob):
+            return True
+        # Texto muy repetitivo ("gracias gracias gracias...")
+        if segmento.compression_ratio is not None and segmento.compression_ratio > self.umbral_compresion:
+            return True
+        return not any(c.isalnum() for c in segmento.texto)
+
+    def filtrar(self, resultado):
+        conservados = []
+        for segmento in resultado.segmentos:
+            if self.es_alucinacion(segmento):
+                logging.info(f"ASR: segmento descartado '{segmento.texto}' (no_speech "
+                             f"{segmento.no_speech_prob}, avg_logprob {segmento.avg_logprob}, "
+                             f"compresión {segmento.compression_ratio})")
+            else:
+                conservados.append(segmento)
+        if len(conservados) != len(resultado.segmentos):
+            resultado.segmentos = conservados
+            resultado.texto = " ".join(s.texto for s in conservados).strip()
+        return resultado
+
+
+def _normalizar_palabra(palabra):
+    return palabra.lower().strip(".,;:¡!¿?\"'")
+
+
+def prefijo_comun(a, b):
+    """Número de palabras iniciales en las que coinciden dos hipótesis"""
+    n = 0
+    for x, y in zip(a, b):
+        if _normalizar_palabra(x) != _normalizar_palabra(y):
+            break
+        n += 1
+    return n
+
+
+class TranscriptorIncremental:
+    """Re-decodifica la cola no confirmada del buffer y confirma lo que se repite entre pasadas"""
+
+    def __init__(self, backend, samplerate=16000, opciones=None, opciones_parciales=None,
+                 minimo_segundos=0.5, politica=None, filtro=None):
+        self.backend = backend
+        self.samplerate = samplerate
+        self.opciones = opciones or OPCIONES_FINALES
+        self.politica = politica
+        self.filtro = filtro
+        self.opciones_parciales = opciones_parciales or OPCIONES_PARCIALES
+        self.minimo = int(minimo_segundos * samplerate)
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.confirmado = []        # palabras ya fijadas
+        self.offset = 0             # muestra desde la que se vuelve a decodificar
+        self._segmentos_previos = []
+        self._palabras_previas = []
+
+    def _contexto(self):
+        return " ".join(self.confirmado[-50:]) or None
+
+    def _decodificar(self, audio, opciones):
+        return self.backend.transcribir(audio, opciones, self._contexto())
+
+    def actualizar(self, audio):
+        """Decodifica la ventana pendiente y devuelve (texto_estable, texto_provisional)"""
+        ventana = audio[self.offset:]
+        if len(ventana) < self.minimo:
+            return " ".join(self.confirmado), ""
+
+        resultado = self._decodificar(ventana, self.opciones_parciales)
+        if self.filtro is not None:
+            resultado = self.filtro.filtrar(resultado)
+        segmentos = resultado.segmentos
+
+        # Los segmentos cerrados que coinciden con la pasada anterior se confirman
+        # y la ventana avanza hasta su final; el último siempre queda abierto
+        confirmar = 0
+        for i, segmento in enumerate(segmentos[:-1]):
+            if i >= len(self._segmentos_previos) or self._segmentos_previos[i] != segmento.texto:
+                break
+            confirmar = i + 1
+        if confirmar:
+            for segmento in segmentos[:confirmar]:
+                self.confirmado.extend(segmento.texto.split())
+            self.offset += int(segmentos[confirmar - 1].fin * self.samplerate)
+            segmentos = segmentos[confirmar:]
+            self._palabras_previas = []
+
+        palabras = " ".join(s.texto for s in segmentos).split()
+        estable = prefijo_comun(palabras, self._palabras_previas)
+        self._segmentos_previos = [s.texto for s in segmentos]
+        self._palabras_previas = palabras
+        return " ".join(self.confirmado + palabras[:estable]), " ".join(palabras[estable:])
+
+    def finalizar(self, audio):
+        """Decodifica solo la cola sin confirmar (con la política adaptativa si la hay) y devuelve el ResultadoASR"""
+        ventana = audio[self.offset:]
+        if self.politica is not None:
+            resultado = self.politica.decodificar(self.backend, ventana, self._contexto())
+        else:
+            resultado = self._decodificar(ventana, self.opciones)
+        if self.filtro is not None:
+            resultado = self.filtro.filtrar(resultado)
+        if self.offset:
+            logging.debug(f"Transcripción final: {self.offset / self.samplerate:.2f}s ya confirmados, "
+                          f"se decodifican {len(ventana) / self.samplerate:.2f}s")
+        resultado.texto = " ".join(self.confirmado + resultado.texto.split())
+        self.reiniciar()
+        return resultado
@@ -0,0 +1,176 @@
+import collections
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+# Preguntas cuya respuesta caduca sola (hora, fecha, clima, actualidad...)
+PATRON_TIEMPO = re.compile(
+    r"\b(hora|horas|fecha|hoy|manana|ayer|ahora|dia|semana|mes|ano|clima|tiempo hace|temperatura|"
+    r"noticias?|ultim[oa]s?|actual(es|mente)?|precio|cotizacion)\b"
+)
+# Preguntas que solo tienen sentido con el turno anterior ("¿y por qué?", "eso qué significa")
+PATRON_CONTEXTO = re.compile(r"^(y|pero|entonces|por que|porque|eso|esto|ese|esa|cual|como asi)\b")
+# Referencias a lo ya hablado en cualquier parte de la pregunta ("explícame eso", "dilo otra vez")
+PATRON_REFERENCIA = re.compile(
+    r"\b(eso|esto|esa|ese|esas|esos|aquello|anterior|antes|tambien|otra vez|lo mismo|ella|ellos|ellas|"
+    r"dijiste|dije|mencionaste|ahi|alli)\b"
+)
+
+
+def normalizar_pregunta(texto):
+    """Minúsculas, sin tildes, sin puntuación y con espacios colapsados"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+class CacheRespuestas:
+    """Caché de respuestas del LLM con TTL, en memoria (LRU) y en SQLite"""
+
+    def __init__(self, ruta, ttl_segundos=86400, max_memoria=256, max_entradas=10000):
+        self.ruta = ruta
+        self.ttl_segundos = ttl_segundos
+        self.max_memoria = max_memoria
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._memoria = collections.OrderedDict()   # clave -> (respuesta, expira, segundos)
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        self.omitidas = 0
+        self.guardadas = 0
+        self.segundos_ahorrados = 0.0
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._db = sqlite3.connect(ruta, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS respuestas ("
+            "clave TEXT PRIMARY KEY, respuesta TEXT NOT NULL, expira REAL NOT NULL, "
+            "segundos REAL NOT NULL, ultimo_uso REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_uso ON respuestas (ultimo_uso)")
+        self._purgar()
+        logging.info(f"Caché de respuestas: {self._contar()} entradas")
+
+    @staticmethod
+    def clave(texto, modelo, sistema, nombre_usuario=None):
+        origen = f"{modelo}|{sistema}|{nombre_usuario or ''}|{normalizar_pregunta(texto)}"
+        return hashlib.sha256(origen.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def depende_del_historial(texto):
+        """Si, habiendo conversación previa, la respuesta puede depender de ella"""
+        pregunta = normalizar_pregunta(texto)
+        # Las preguntas de una o dos palabras ("¿y Francia?", "¿Alemania?") suelen ser elípticas
+        return len(pregunta.split()) <= 2 or bool(PATRON_REFERENCIA.search(pregunta))
+
+    @staticmethod
+    def es_cacheable(texto):
+        pregunta = normalizar_pregunta(texto)
+        return bool(pregunta) and not PATRON_TIEMPO.search(pregunta) and not PATRON_CONTEXTO.search(pregunta)
+
+    def obtener(self, texto, modelo, sistema, nombre_usuario=None):
+        """Respuesta guardada para la misma pregunta con el mismo modelo, sistema y usuario, o None"""
+        if not self.es_cacheable(texto):
+            with self._lock:
+                self.omitidas += 1
+            return None
+
+        clave = self.clave(texto, modelo, sistema, nombre_usuario)
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None and entrada[1] > ahora:
+                self._memoria.move_to_end(clave)
+                self.aciertos_memoria += 1
+                self.segundos_ahorrados += entrada[2]
+                return entrada[0]
+            self._memoria.pop(clave, None)
+
+            fila = self._db.execute(
+                "SELECT respuesta, expira, segundos FROM respuestas WHERE clave = ? AND expira > ?",
+                (clave, ahora)
+            ).fetchone()
+            if fila is None:
+                self.fallos += 1
+                return None
+            self._db.execute("UPDATE respuestas SET ultimo_uso = ? WHERE clave = ?", (ahora, clave))
+            self._db.commit()
+            self.aciertos_disco += 1
+            self.segundos_ahorrados += fila[2]
+            self._guardar_memoria(clave, fila)
+            return fila[0]
+
+    def guardar(self, texto, respuesta, segundos, modelo, sistema, nombre_usuario=None, ttl_segundos=None):
+        """Guarda una respuesta completa; `segundos` es lo que costó generarla"""
+        if not respuesta or not self.es_cacheable(texto):
+            return
+        clave = self.clave(texto, modelo, sistema, nombre_usuario)
+        ahora = time.time()
+        expira = ahora + (ttl_segundos if ttl_segundos is not None else self.ttl_segundos)
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO respuestas (clave, respuesta, expira, segundos, ultimo_uso) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (clave, respuesta, expira, segundos, ahora)
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Error guardando caché de respuestas: {e}")
+            self._guardar_memoria(clave, (respuesta, expira, segundos))
+            self.guardadas += 1
+            purgar = self.guardadas % 100 == 0
+        if purgar:
+            self._purgar()
+
+    def _guardar_memoria(self, clave, entrada):
+        self._memoria[clave] = tuple(entrada)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+
+    def _purgar(self):
+        """Borra las entradas caducadas y, si sobran, las de uso más antiguo"""
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM respuestas WHERE expira <= ?", (time.time(),))
+                self._db.execute(
+                    "DELETE FROM respuestas WHERE clave IN (SELECT clave FROM respuestas "
+                    "ORDER BY ultimo_uso DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entradas,)
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Error purgando caché de respuestas: {e}")
+
+    def _contar(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+
+    def estadisticas(self):
+        entradas = self._contar()
+        with self._lock:
+            consultas = self.aciertos_memoria + self.aciertos_disco + self.fallos
+            return {
+                "aciertos_memoria": self.aciertos_memoria,
+                "aciertos_disco": self.aciertos_disco,
+                "fallos": self.fallos,
+                "omitidas": self.omitidas,
+                "tasa_aciertos": (self.aciertos_memoria + self.aciertos_disco) / consultas if consultas else 0.0,
+                "segundos_ahorrados": self.segundos_ahorrados,
+                "entradas_memoria": len(self._memoria),
+                "entradas_disco": entradas
+            }
+
+    def cerrar(self):
+        with self._lock:
+            self._db.close()
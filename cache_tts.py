@@ -0,0 +1,180 @@
+import collections
+import hashlib
+import logging
+import os
+import threading
+import unicodedata
+
+from tts import MotorTTS, ResultadoTTS, segmentar_texto
+
+
+def normalizar_texto(texto):
+    return " ".join(unicodedata.normalize("NFC", texto).split())
+
+
+class CacheTTS:
+    """Caché de audio sintetizado direccionada por contenido, en disco y en memoria, con desalojo LRU"""
+
+    def __init__(self, directorio, limite_bytes=100 * 1024 * 1024, limite_memoria_bytes=8 * 1024 * 1024):
+        self.directorio = directorio
+        self.limite_bytes = limite_bytes
+        self.limite_memoria_bytes = limite_memoria_bytes
+        self._lock = threading.Lock()
+        self._memoria = collections.OrderedDict()   # clave -> ResultadoTTS
+        self._bytes_memoria = 0
+        self._disco = collections.OrderedDict()     # clave -> (ruta, bytes), del menos al más reciente
+        self._bytes_disco = 0
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        self._cargar_indice()
+
+    def _cargar_indice(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        entradas = []
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            if nombre.endswith(".tmp"):
+                os.remove(ruta)
+            elif os.path.isfile(ruta):
+                estado = os.stat(ruta)
+                entradas.append((estado.st_mtime, nombre, ruta, estado.st_size))
+        # El mtime hace de marca de último uso entre ejecuciones
+        for _, nombre, ruta, tamano in sorted(entradas):
+            self._disco[nombre] = (ruta, tamano)
+            self._bytes_disco += tamano
+        self._desalojar_disco()
+        logging.info(f"Caché TTS: {len(self._disco)} entradas, {self._bytes_disco / 1024:.0f} KiB")
+
+    @staticmethod
+    def clave(motor, texto):
+        origen = f"{motor.identidad}|{normalizar_texto(texto)}"
+        return f"{hashlib.sha256(origen.encode('utf-8')).hexdigest()}.{motor.formato}"
+
+    def contiene(self, motor, texto):
+        with self._lock:
+            return self.clave(motor, texto) in self._disco
+
+    def obtener(self, motor, texto):
+        clave = self.clave(motor, texto)
+        with self._lock:
+            if clave in self._memoria:
+                self._memoria.move_to_end(clave)
+                self.aciertos_memoria += 1
+                return self._memoria[clave]
+            if clave not in self._disco:
+                self.fallos += 1
+                return None
+            ruta, _ = self._disco[clave]
+            self._disco.move_to_end(clave)
+        try:
+            with open(ruta, "rb") as archivo:
+                audio = archivo.read()
+            os.utime(ruta)
+        except OSError as e:
+            logging.error(f"Error leyendo caché TTS {ruta}: {e}")
+            with self._lock:
+                self._olvidar_disco(clave)
+                self.fallos += 1
+            return None
+        resultado = ResultadoTTS(audio, motor.formato, 0.0)
+        with self._lock:
+            self.aciertos_disco += 1
+            self._guardar_memoria(clave, resultado)
+        return resultado
+
+    def guardar(self, motor, texto, resultado):
+        clave = self.clave(motor, texto)
+        ruta = os.path.join(self.directorio, clave)
+        try:
+            temporal = f"{ruta}.tmp"
+            with open(temporal, "wb") as archivo:
+                archivo.write(resultado.audio)
+            os.replace(temporal, ruta)
+        except OSError as e:
+            logging.error(f"Error guardando caché TTS {ruta}: {e}")
+            return
+        with self._lock:
+            self._olvidar_disco(clave)
+            self._disco[clave] = (ruta, len(resultado.audio))
+            self._bytes_disco += len(resultado.audio)
+            self._desalojar_disco()
+            self._guardar_memoria(clave, resultado)
+
+    def _guardar_memoria(self, clave, resultado):
+        if clave in self._memoria:
+            self._bytes_memoria -= len(self._memoria.pop(clave).audio)
+        self._memoria[clave] = resultado
+        self._bytes_memoria += len(resultado.audio)
+        while self._bytes_memoria > self.limite_memoria_bytes and len(self._memoria) > 1:
+            _, antiguo = self._memoria.popitem(last=False)
+            self._bytes_memoria -= len(antiguo.audio)
+
+    def _olvidar_disco(self, clave):
+        if clave in self._disco:
+            _, tamano = self._disco.pop(clave)
+            self._bytes_disco -= tamano
+
+    def _desalojar_disco(self):
+        while self._bytes_disco > self.limite_bytes and self._disco:
+            clave, (ruta, tamano) = self._disco.popitem(last=False)
+            self._bytes_disco -= tamano
+            try:
+                os.remove(ruta)
+            except OSError as e:
+                logging.error(f"Error desalojando caché TTS {ruta}: {e}")
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos_memoria + self.aciertos_disco + self.fallos
+            return {
+                "aciertos_memoria": self.aciertos_memoria,
+                "aciertos_disco": self.aciertos_disco,
+                "fallos": self.fallos,
+                "tasa_aciertos": (self.aciertos_memoria + self.aciertos_disco) / consultas if consultas else 0.0,
+                "entradas_disco": len(self._disco),
+                "bytes_disco": self._bytes_disco,
+                "bytes_memoria": self._bytes_memoria
+            }
+
+
+class MotorConCache(MotorTTS):
+    """Envuelve un motor para servir desde la caché y guardar lo que sintetiza"""
+
+    def __init__(self, motor, cache):
+        self.motor = motor
+        self.cache = cache
+        self.nombre = motor.nombre
+        self.formato = motor.formato
+        self.idioma = motor.idioma
+        self.voz = motor.voz
+
+    @property
+    def identidad(self):
+        return self.motor.identidad
+
+    def _sintetizar(self, texto):
+        return self.sintetizar(texto).audio
+
+    def sintetizar(self, texto):
+        resultado = self.cache.obtener(self.motor, texto)
+        if resultado is None:
+            resultado = self.motor.sintetizar(texto)
+            self.cache.guardar(self.motor, texto, resultado)
+        return resultado
+
+    def calentar(self, textos):
+        """Sintetiza en segundo plano las frases fijas que aún no estén en caché"""
+        def calentar():
+            for texto in textos:
+                for frase in segmentar_texto(texto):
+                    if self.cache.contiene(self.motor, frase):
+                        continue
+                    try:
+                        self.cache.guardar(self.motor, frase, self.motor.sintetizar(frase))
+                    except Exception as e:
+                        logging.error(f"Error precalentando caché TTS: {e}")
+
+        hilo = threading.Thread(target=calentar, daemon=True)
+        hilo.start()
+        return hilo
@@ -0,0 +1,433 @@
+import collections
+import contextlib
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+from procesamiento_audio import Remuestreador
+
+
+class DetectorVoz:
+    """Detector de actividad de voz por energía con piso de ruido adaptativo
+
+    El piso es el mínimo de la energía de los bloques de los últimos `piso_ms` (estadística de
+    mínimos): se sigue en todos los bloques, también durante la voz, cuyas pausas entre palabras
+    lo mantienen abajo. Así se aprende aunque el ruido de la sala supere umbral_min_dbfs.
+    """
+
+    INICIO = "inicio"
+    FIN = "fin"
+
+    def __init__(self, samplerate, bloque_ms=30, umbral_db=10.0, umbral_min_dbfs=-50.0,
+                 inicio_ms=90, silencio_ms=800, piso_ms=5000):
+        self.samplerate = samplerate
+        self.bloque = max(1, int(samplerate * bloque_ms / 1000))
+        self.bloques_piso = max(1, round(piso_ms / bloque_ms))
+        self.umbral_db = umbral_db
+        self.umbral_min_dbfs = umbral_min_dbfs
+        self.bloques_inicio = max(1, round(inicio_ms / bloque_ms))
+        self.bloques_silencio = max(1, round(silencio_ms / bloque_ms))
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.piso_db = None
+        self._energias = collections.deque(maxlen=self.bloques_piso)
+        self.hablando = False
+        self.bloques_voz = 0
+        self._voz_seguida = 0
+        self._silencio_seguido = 0
+        self._pendiente = np.zeros(0, dtype=np.float32)
+
+    @staticmethod
+    def energia_dbfs(bloque):
+        return 10.0 * np.log10(np.mean(np.square(bloque, dtype=np.float64)) + 1e-12)
+
+    def es_voz(self, energia_db):
+        umbral = self.umbral_min_dbfs
+        if self.piso_db is not None:
+            umbral = max(umbral, self.piso_db + self.umbral_db)
+        return energia_db > umbral
+
+    def actualizar_piso(self, energia_db):
+        self._energias.append(energia_db)
+        self.piso_db = min(self._energias)
+
+    def procesar(self, audio):
+        """Procesa audio mono y devuelve DetectorVoz.INICIO, DetectorVoz.FIN o None"""
+        audio = np.concatenate((self._pendiente, np.asarray(audio, dtype=np.float32).reshape(-1)))
+        n = len(audio) // self.bloque * self.bloque
+        self._pendiente = audio[n:]
+
+        evento = None
+        for bloque in audio[:n].reshape(-1, self.bloque):
+            energia = self.energia_dbfs(bloque)
+            self.actualizar_piso(energia)
+            voz = self.es_voz(energia)
+            self.bloques_voz += voz
+            if not self.hablando:
+                if voz:
+                    self._voz_seguida += 1
+                    if self._voz_seguida >= self.bloques_inicio:
+                        self.hablando = True
+                        self._silencio_seguido = 0
+                        evento = self.INICIO
+                else:
+                    self._voz_seguida = 0
+            else:
+                if voz:
+                    self._silencio_seguido = 0
+                else:
+                    self._silencio_seguido += 1
+                    if self._silencio_seguido >= self.bloques_silencio:
+                        self.hablando = False
+                        self._voz_seguida = 0
+                        return self.FIN
+        return evento
+
+    @property
+    def segundos_voz(self):
+        """Tiempo total de bloques por encima del umbral desde el último reinicio"""
+        return self.bloques_voz * self.bloque / self.samplerate
+
+
+class BufferCircular:
+    """Últimos `capacidad` muestras de un flujo, direccionadas por posición absoluta
+
+    Un único escritor (el callback del micrófono) y lectores que piden rangos por posición:
+    escribir no reserva memoria, así que es seguro dentro del callback de audio.
+    """
+
+    def __init__(self, capacidad):
+        self.capacidad = int(capacidad)
+        self._datos = np.zeros(self.capacidad, dtype=np.float32)
+        self.posicion = 0   # muestras escritas desde el inicio
+
+    def escribir(self, bloque):
+        n = len(bloque)
+        # De un bloque mayor que el buffer solo cabe el final, pero la posición cuenta todo
+        bloque = bloque[-self.capacidad:]
+        inicio = (self.posicion + n - len(bloque)) % self.capacidad
+        primero = min(len(bloque), self.capacidad - inicio)
+        self._datos[inicio:inicio + primero] = bloque[:primero]
+        self._datos[:len(bloque) - primero] = bloque[primero:]
+        self.posicion += n
+
+    def vistas(self, desde, hasta=None):
+        """Vistas (sin copia) de las muestras [desde, hasta): una, o dos si el rango da la vuelta
+
+        Lo ya sobrescrito se recorta. Las vistas son válidas hasta que el escritor da otra vuelta.
+        """
+        hasta = self.posicion if hasta is None else min(hasta, self.posicion)
+        desde = max(desde, self.posicion - self.capacidad, 0)
+        if desde >= hasta:
+            return ()
+        i, j = desde % self.capacidad, hasta % self.capacidad
+        if i < j:
+            return (self._datos[i:j],)
+        return (self._datos[i:], self._datos[:j]) if j else (self._datos[i:],)
+
+    def leer(self, desde, hasta=None):
+        """Copia de las muestras [desde, hasta); lo ya sobrescrito se recorta"""
+        vistas = self.vistas(desde, hasta)
+        if not vistas:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(vistas) if len(vistas) > 1 else vistas[0].copy()
+
+
+class ServicioCaptura:
+    """Micrófono abierto de forma permanente sobre un buffer circular compartido
+
+    El callback solo escribe en el buffer y avisa a los lectores; cada consumidor (grabación,
+    VAD, palabra clave, medidor de nivel) lleva su propio cursor y lee vistas del mismo buffer.
+    Empezar a grabar es marcar una posición, que puede quedar atrás para incluir un pre-roll.
+    """
+
+    def __init__(self, samplerate, bloque, buffer_segundos=30.0):
+        self.samplerate = samplerate
+        self.bloque = bloque
+        self.buffer = BufferCircular(int(samplerate * buffer_segundos))
+        self.desbordes = 0
+        self._suscriptores = ()     # tupla inmutable: el callback la recorre sin bloqueos
+        self._lock = threading.Lock()
+        self._stream = None
+
+    def abrir(self):
+        import sounddevice as sd
+
+        samplerate_dispositivo = samplerate_captura(sd, self.samplerate)
+        remuestreador = None
+        if samplerate_dispositivo != self.samplerate:
+            remuestreador = Remuestreador(samplerate_dispositivo, self.samplerate)
+
+        def callback(indata, frames, tiempo, status):
+            if status:
+                self.desbordes += 1
+            bloque = indata[:, 0]
+            self.buffer.escribir(remuestreador.procesar(bloque) if remuestreador else bloque)
+            for avisos in self._suscriptores:
+                avisos.put(None)
+
+        inicio = time.perf_counter()
+        self._stream = sd.InputStream(samplerate=samplerate_dispositivo, channels=1, dtype='float32',
+                                      blocksize=int(self.bloque * samplerate_dispositivo / self.samplerate),
+                                      callback=callback)
+        self._stream.start()
+        logging.info(f"Micrófono abierto en {time.perf_counter() - inicio:.2f}s ({samplerate_dispositivo} Hz)")
+        return self
+
+    @property
+    def posicion(self):
+        return self.buffer.posicion
+
+    def marcar(self, preroll_ms=0):
+        """Posición actual retrasada `preroll_ms` (sin ir más atrás de lo que guarda el buffer)"""
+        posicion = self.buffer.posicion
+        atras = int(self.samplerate * preroll_ms / 1000)
+        return max(0, posicion - self.buffer.capacidad, posicion - atras)
+
+    def lector(self, desde=None):
+        return LectorCaptura(self, self.posicion if desde is None else desde)
+
+    def leer(self, desde, hasta=None):
+        return self.buffer.leer(desde, hasta)
+
+    def nivel_dbfs(self, ventana_ms=100):
+        """Nivel de los últimos `ventana_ms` sin copiar el audio"""
+        n = int(self.samplerate * ventana_ms / 1000)
+        vistas = self.buffer.vistas(self.posicion - n)
+        muestras = sum(len(v) for v in vistas)
+        if not muestras:
+            return None
+        energia = sum(float(np.dot(v, v)) for v in vistas) / muestras
+        return 10.0 * np.log10(energia + 1e-12)
+
+    def _suscribir(self, avisos):
+        with self._lock:
+            self._suscriptores = self._suscriptores + (avisos,)
+
+    def _desuscribir(self, avisos):
+        with self._lock:
+            self._suscriptores = tuple(a for a in self._suscriptores if a is not avisos)
+
+    @property
+    def abierto(self):
+        return self._stream is not None
+
+    def cerrar(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+
+
+class LectorCaptura:
+    """Cursor de un consumidor sobre el buffer de un ServicioCaptura"""
+
+    def __init__(self, captura, desde):
+        self.captura = captura
+        self.posicion = desde
+        self.perdidas = 0
+        self._avisos = queue.SimpleQueue()
+        captura._suscribir(self._avisos)
+
+    def siguiente(self, timeout=0.1):
+        """Audio nuevo desde la última lectura, o None si no llegó nada a tiempo
+
+        Es una vista del buffer compartido salvo cuando el rango da la vuelta al anillo.
+        """
+        buffer = self.captura.buffer
+        if self.posicion >= buffer.posicion:
+            try:
+                self._avisos.get(timeout=timeout)
+            except queue.Empty:
+                return None
+        hasta = buffer.posicion
+        perdidas = hasta - buffer.capacidad - self.posicion
+        if perdidas > 0:
+            # El consumidor se quedó una vuelta atrás: se salta lo sobrescrito
+            self.perdidas += perdidas
+            logging.warning(f"Lector de captura retrasado: {perdidas} muestras perdidas")
+        vistas = buffer.vistas(self.posicion, hasta)
+        self.posicion = hasta
+        if not vistas:
+            return None
+        return np.concatenate(vistas) if len(vistas) > 1 else vistas[0]
+
+    def saltar(self):
+        """Descarta lo pendiente: la próxima lectura empieza en el presente"""
+        self.posicion = self.captura.posicion
+
+    def cerrar(self):
+        self.captura._desuscribir(self._avisos)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+@contextlib.contextmanager
+def abrir_lector(captura, samplerate, bloque, desde=None):
+    """Lector sobre `captura`; sin servicio compartido se abre un micrófono solo para esta lectura"""
+    propia = captura is None
+    if propia:
+        captura = ServicioCaptura(samplerate, bloque, buffer_segundos=5.0).abrir()
+    elif captura.samplerate != samplerate:
+        raise ValueError(f"La captura es a {captura.samplerate} Hz y se pidió {samplerate} Hz")
+    try:
+        with captura.lector(desde) as lector:
+            yield lector
+    finally:
+        if propia:
+            captura.cerrar()
+
+
+def samplerate_captura(sd, deseado):
+    """Usa la tasa deseada si el micrófono la admite; si no, la nativa del dispositivo"""
+    try:
+        sd.check_input_settings(samplerate=deseado, channels=1, dtype='float32')
+        return deseado
+    except Exception:
+        nativo = int(sd.query_devices(kind='input')['default_samplerate'])
+        logging.info(f"El micrófono no admite {deseado} Hz, se captura a {nativo} Hz y se remuestrea")
+        return nativo
+
+
+def grabar_hasta_silencio(detector, frontend=None, max_segundos=15.0, espera_segundos=6.0,
+                          preroll_ms=300, debe_continuar=lambda: True, on_evento=None,
+                          on_bloque=None, audio_previo=None, captura=None, desde=None):
+    """Graba del micrófono hasta fin de voz; devuelve el audio mono o None si no hubo voz
+
+    Con un ServicioCaptura abierto la grabación empieza en `desde` o, si no se indica,
+    `preroll_ms` antes de la llamada: lo dicho justo antes de pulsar también cuenta.
+    """
+    samplerate = detector.samplerate
+    # El audio previo ya trae su propio pre-roll: volver a leerlo del buffer lo duplicaría
+    if desde is None and captura is not None:
+        desde = captura.marcar(preroll_ms if audio_previo is None else 0)
+
+    preroll = collections.deque()
+    muestras_preroll = 0
+    previo = []
+    if audio_previo is not None:
+        audio_previo = np.asarray(audio_previo, dtype=np.float32)
+        previo = [frontend.procesar(audio_previo) if frontend else audio_previo]
+    max_preroll = int(samplerate * preroll_ms / 1000)
+    grabado = []
+    muestras = 0
+    detector.reiniciar()
+    inicio = time.monotonic()
+
+    with abrir_lector(captura, samplerate, detector.bloque, desde) as lector:
+        while debe_continuar():
+            bloque = lector.siguiente()
+            if bloque is None:
+                continue
+
+            evento = detector.procesar(bloque)
+            # El VAD decide sobre la señal cruda; al buffer de ASR va la procesada (o una copia:
+            # la vista del buffer compartido acabaría sobrescrita)
+            bloque = frontend.procesar(bloque) if frontend else bloque.copy()
+            if detector.hablando or evento == DetectorVoz.FIN:
+                nuevos = [bloque] if grabado else previo + list(preroll) + [bloque]
+                for b in nuevos:
+                    grabado.append(b)
+                    muestras += len(b)
+                    if on_bloque:
+                        on_bloque(b)
+            else:
+                preroll.append(bloque)
+                muestras_preroll += len(bloque)
+                while preroll and muestras_preroll - len(preroll[0]) >= max_preroll:
+                    muestras_preroll -= len(preroll.popleft())
+
+            if evento and on_evento:
+                on_evento(evento)
+            if evento == DetectorVoz.FIN:
+                break
+            if not grabado and time.monotonic() - inicio > espera_segundos:
+                logging.info("No se detectó voz, captura cancelada")
+                return None
+            if muestras >= max_segundos * samplerate:
+                logging.info(f"Captura detenida por duración máxima ({max_segundos}s)")
+                break
+
+    if not grabado:
+        return None
+    if frontend:
+        grabado.append(frontend.finalizar())
+    audio = np.concatenate(grabado)
+    logging.info(f"Voz capturada: {len(audio) / samplerate:.2f}s")
+    return audio
+
+
+def esperar_interrupcion(detector, nivel_referencia, margen_db=10.0, inicio_ms=200, preroll_ms=500,
+                         calibracion_ms=300, debe_continuar=lambda: True, on_deteccion=None, captura=None):
+    """Vigila el micrófono mientras habla el asistente y, si el usuario lo interrumpe, devuelve
+    dónde empieza su voz (con `preroll_ms` de margen): la posición en `captura` o, sin captura
+    compartida, una copia de ese audio. None si no hubo interrupción.
+    """
+    samplerate = detector.samplerate
+    bloques_inicio = max(1, round(inicio_ms / (1000 * detector.bloque / samplerate)))
+    bloques_calibracion = round(calibracion_ms / (1000 * detector.bloque / samplerate))
+    bloques_reproduccion = 0
+    max_preroll = int(samplerate * preroll_ms / 1000)
+    preroll = collections.deque()
+    muestras_preroll = 0
+    acople_db = None
+    voz_seguida = 0
+    detector.reiniciar()
+
+    with abrir_lector(captura, samplerate, detector.bloque) as lector:
+        while debe_continuar():
+            bloque = lector.siguiente()
+            if bloque is None or not len(bloque):
+                continue
+            if captura is None:
+                # Con captura compartida el pre-roll ya está en su buffer
+                preroll.append(bloque.copy())
+                muestras_preroll += len(bloque)
+                while preroll and muestras_preroll - len(preroll[0]) >= max_preroll:
+                    muestras_preroll -= len(preroll.popleft())
+
+            # nivel_referencia() es el nivel de lo que suena (None en silencio); el acople
+            # altavoz-micrófono se aprende y solo cuenta la voz que lo supera en margen_db
+            energia = detector.energia_dbfs(bloque)
+            referencia = nivel_referencia()
+            voz = detector.es_voz(energia)
+            if referencia is not None:
+                bloques_reproduccion += 1
+            if voz and referencia is not None:
+                exceso = energia - referencia
+                # El eco está en todos los bloques y la voz del usuario solo se le suma: el acople
+                # sigue la envolvente inferior (baja deprisa, sube despacio), así que si el usuario
+                # habla primero su nivel no queda como referencia en cuanto suena un bloque de eco
+                if acople_db is None:
+                    acople_db = exceso
+                elif exceso < acople_db:
+                    acople_db += 0.5 * (exceso - acople_db)
+                elif exceso <= acople_db + margen_db:
+                    acople_db += 0.05 * (exceso - acople_db)
+                # Durante la calibración (inicio de la reproducción) todo se toma por eco
+                if bloques_reproduccion <= bloques_calibracion or exceso <= acople_db + margen_db:
+                    voz = False
+            if referencia is None:
+                # Con el altavoz callado lo que entra es ruido de la sala o el usuario
+                detector.actualizar_piso(energia)
+            if not voz:
+                voz_seguida = 0
+                continue
+
+            voz_seguida += 1
+            if voz_seguida >= bloques_inicio:
+                logging.info(f"Interrupción detectada ({energia:.1f} dBFS, acople {acople_db})")
+                if on_deteccion:
+                    on_deteccion()
+                if captura is not None:
+                    return max(0, lector.posicion - max_preroll)
+                return np.concatenate(preroll)
+    return None
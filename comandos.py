@@ -0,0 +1,182 @@
+import logging
+import re
+import subprocess
+import urllib.parse
+import webbrowser
+
+from cache_respuestas import normalizar_pregunta
+
+
+# Cortesías que no cambian la orden: se ignoran al principio y al final. "por" solo cuenta
+# como parte de "por favor" para no confundir "por qué ir a..." con una orden
+RELLENO = {"porfa", "puedes", "podrias", "me"}
+RELLENO_FINAL = {"por", "favor", "porfa", "gracias"}
+
+PATRON_DOMINIO = re.compile(r"^(https?://)?([\w-]+\.)+[a-z]{2,}(/\S*)?$")
+
+
+class Comando:
+    """Orden de escritorio reconocible por una o varias frases"""
+
+    def __init__(self, nombre, frases, accion, confirmacion, con_parametro=False, interpretar=None):
+        self.nombre = nombre
+        self.frases = frases
+        self.accion = accion
+        self.confirmacion = confirmacion
+        self.con_parametro = con_parametro
+        # interpretar(parametro) -> parámetro limpio, o None si la frase no es esta orden
+        self.interpretar = interpretar
+
+
+class Intencion:
+    def __init__(self, comando, parametro="", distancia=0):
+        self.comando = comando
+        self.parametro = parametro
+        self.distancia = distancia
+
+    def ejecutar(self):
+        """Lanza la acción y devuelve la confirmación que hay que decir"""
+        try:
+            if self.comando.con_parametro:
+                self.comando.accion(self.parametro)
+            else:
+                self.comando.accion()
+            return self.comando.confirmacion
+        except Exception as e:
+            logging.error(f"Error al ejecutar comando {self.comando.nombre}: {e}")
+            return f"No pude {self.comando.nombre}."
+
+
+class _Nodo:
+    __slots__ = ("hijos", "comando")
+
+    def __init__(self):
+        self.hijos = {}
+        self.comando = None
+
+
+def _tolerancia(palabra):
+    # Las palabras cortas deben coincidir exactas: "ir" no puede ser "a"
+    return 0 if len(palabra) <= 3 else 1 if len(palabra) <= 6 else 2
+
+
+def _distancia(a, b, maximo):
+    """Levenshtein con corte: devuelve maximo + 1 en cuanto se sabe que lo supera"""
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    anterior = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            actual.append(min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb)))
+        if min(actual) > maximo:
+            return maximo + 1
+        anterior = actual
+    return anterior[-1]
+
+
+class RouterComandos:
+    """Resuelve órdenes antes que el LLM con un trie de palabras precompilado
+
+    Cada frase se normaliza (minúsculas, sin tildes ni puntuación) y se inserta palabra a
+    palabra; al buscar, cada palabra admite una distancia de edición proporcional a su
+    longitud para tolerar errores del ASR ("calculadoras", "abrír", "crome").
+    """
+
+    def __init__(self, comandos):
+        self.comandos = list(comandos)
+        self._raiz = _Nodo()
+        for comando in self.comandos:
+            for frase in comando.frases:
+                nodo = self._raiz
+                for palabra in normalizar_pregunta(frase).split():
+                    nodo = nodo.hijos.setdefault(palabra, _Nodo())
+                nodo.comando = comando
+
+    def resolver(self, texto, nombre_asistente=None):
+        """Intención reconocida en el texto o None si hay que pasárselo al LLM"""
+        originales = texto.lower().split()
+        palabras = [normalizar_pregunta(p) for p in originales]
+        inicio = 0
+        ignorar = RELLENO | ({normalizar_pregunta(nombre_asistente)} if nombre_asistente else set())
+        while inicio < len(palabras):
+            if palabras[inicio:inicio + 2] == ["por", "favor"]:
+                inicio += 2
+            elif not palabras[inicio] or palabras[inicio] in ignorar:
+                inicio += 1
+            else:
+                break
+
+        mejor = None
+        for fin, comando, distancia in self._recorrer(self._raiz, palabras, inicio, 0):
+            resto = [p for p in palabras[fin:] if p]
+            if comando.con_parametro:
+                if not resto:
+                    continue
+                parametro = " ".join(originales[fin:]).strip(" .,;:!?¡¿")
+                if comando.interpretar is not None:
+                    parametro = comando.interpretar(parametro)
+                if not parametro:
+                    continue
+            else:
+                if any(p not in RELLENO_FINAL for p in resto):
+                    continue
+                parametro = ""
+            # Gana la frase más larga y, a igual longitud, la más parecida
+            clave = (fin, -distancia)
+            if mejor is None or clave > mejor[0]:
+                mejor = (clave, Intencion(comando, parametro, distancia))
+        return mejor[1] if mejor else None
+
+    def _recorrer(self, nodo, palabras, i, distancia):
+        if nodo.comando is not None:
+            yield i, nodo.comando, distancia
+        if i >= len(palabras):
+            return
+        palabra = palabras[i]
+        if not palabra:
+            yield from self._recorrer(nodo, palabras, i + 1, distancia)
+            return
+        hijo = nodo.hijos.get(palabra)
+        if hijo is not None:
+            yield from self._recorrer(hijo, palabras, i + 1, distancia)
+            return
+        maximo = _tolerancia(palabra)
+        if not maximo:
+            return
+        for clave, hijo in nodo.hijos.items():
+            d = _distancia(palabra, clave, min(maximo, _tolerancia(clave)))
+            if d <= min(maximo, _tolerancia(clave)):
+                yield from self._recorrer(hijo, palabras, i + 1, distancia + d)
+
+
+def _abrir_url(url):
+    webbrowser.open(url if url.startswith(("http", "www")) else f"https://{url}")
+
+
+def _interpretar_url(texto):
+    """Dominio dictado ("google punto com") o None si no lo parece ("ir a la playa")"""
+    url = re.sub(r"\s+punto\s+", ".", texto.lower()).replace(" ", "")
+    return url if PATRON_DOMINIO.match(url) else None
+
+
+def _interpretar_cancion(texto):
+    # "pon la canción de queen" busca "queen"
+    return re.sub(r"^de\s+", "", texto, flags=re.IGNORECASE)
+
+
+COMANDOS = [
+    Comando("abrir Chrome", ["abrir chrome", "abre chrome", "abrir navegador", "abre el navegador"],
+            lambda: subprocess.Popen("chrome.exe"), "Abriendo Chrome."),
+    Comando("abrir el bloc de notas", ["abrir notepad", "abre notepad", "abrir bloc de notas", "abre el bloc de notas"],
+            lambda: subprocess.Popen("notepad.exe"), "Abriendo el bloc de notas."),
+    Comando("abrir la calculadora", ["abrir calculadora", "abre calculadora", "abrir la calculadora",
+                                     "abre la calculadora"],
+            lambda: subprocess.Popen("calc.exe"), "Abriendo la calculadora."),
+    Comando("abrir la página", ["ir a", "ve a", "abrir la pagina", "abre la pagina"],
+            _abrir_url, "Abriendo la página.", con_parametro=True, interpretar=_interpretar_url),
+    Comando("reproducir eso", ["reproducir", "reproduce", "pon la cancion", "pon musica de"],
+            lambda cancion: webbrowser.open("https://www.youtube.com/results?search_query="
+                                            + urllib.parse.quote_plus(cancion)),
+            "Buscando en YouTube.", con_parametro=True, interpretar=_interpretar_cancion),
+]
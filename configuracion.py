@@ -0,0 +1,115 @@
+import os
+
+
+def _env_float(nombre, defecto):
+    try:
+        return float(os.environ.get(nombre, defecto))
+    except ValueError:
+        return defecto
+
+
+def _env_int(nombre, defecto):
+    try:
+        return int(os.environ.get(nombre, defecto))
+    except ValueError:
+        return defecto
+
+
+# Conversación
+nombre_asistente = os.environ.get("ELISA_NOMBRE", "ELISA")
+llm_modelo = os.environ.get("ELISA_LLM_MODELO", "mistral")
+llm_keep_alive = os.environ.get("ELISA_LLM_KEEP_ALIVE", "30m")   # cuánto retiene Ollama el modelo en memoria
+llm_ping_segundos = _env_int("ELISA_LLM_PING_SEGUNDOS", 240)      # renovación mientras haya sesiones activas
+llm_presupuesto_tokens = _env_int("ELISA_LLM_PRESUPUESTO_TOKENS", 1024)  # historial antes de resumir
+
+# Caché de respuestas del LLM (memoria + SQLite); no se usa para preguntas de hora, fecha, clima...
+llm_cache = os.environ.get("ELISA_LLM_CACHE", "1") == "1"
+llm_cache_ruta = os.environ.get("ELISA_LLM_CACHE_RUTA",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_respuestas.sqlite3"))
+llm_cache_ttl_segundos = _env_int("ELISA_LLM_CACHE_TTL_SEGUNDOS", 7 * 24 * 3600)
+llm_cache_memoria = _env_int("ELISA_LLM_CACHE_MEMORIA", 256)         # entradas en el nivel LRU
+llm_cache_max_entradas = _env_int("ELISA_LLM_CACHE_MAX_ENTRADAS", 10000)  # filas en disco
+
+# Captura de voz con detección de actividad (VAD)
+vad_bloque_ms = _env_int("ELISA_VAD_BLOQUE_MS", 30)
+vad_umbral_db = _env_float("ELISA_VAD_UMBRAL_DB", 10.0)       # dB sobre el piso de ruido
+vad_umbral_min_dbfs = _env_float("ELISA_VAD_UMBRAL_MIN_DBFS", -50.0)
+vad_inicio_ms = _env_int("ELISA_VAD_INICIO_MS", 90)           # voz continua para declarar inicio
+vad_silencio_ms = _env_int("ELISA_VAD_SILENCIO_MS", 800)      # hangover antes de cortar
+vad_preroll_ms = _env_int("ELISA_VAD_PREROLL_MS", 300)
+vad_max_segundos = _env_float("ELISA_VAD_MAX_SEGUNDOS", 15.0)
+vad_espera_segundos = _env_float("ELISA_VAD_ESPERA_SEGUNDOS", 6.0)  # sin voz: se abandona
+vad_min_voz_ms = _env_int("ELISA_VAD_MIN_VOZ_MS", 250)        # menos voz que esto: turno vacío, sin ASR
+# Micrófono abierto toda la sesión: grabar es marcar una posición del buffer (con vad_preroll_ms atrás)
+captura_persistente = os.environ.get("ELISA_CAPTURA_PERSISTENTE", "1") == "1"
+captura_buffer_segundos = _env_float("ELISA_CAPTURA_BUFFER_SEGUNDOS", 30.0)
+
+# Transcripción
+asr_backend = os.environ.get("ELISA_ASR_BACKEND", "whisper")            # whisper | faster-whisper (int8, más rápido en CPU)
+asr_modelo = os.environ.get("ELISA_ASR_MODELO", "small")                # tiny | base | small | medium ...
+asr_compute_type = os.environ.get("ELISA_ASR_COMPUTE", "int8")          # solo faster-whisper: int8 | int8_float32 | float32
+asr_procesos = _env_int("ELISA_ASR_PROCESOS", 1)                        # procesos de ASR de la GUI; 0: en un hilo
+asr_samplerate = 16000                                        # tasa nativa de Whisper
+guardar_wav_debug = os.environ.get("ELISA_GUARDAR_WAV", "0") == "1"
+# Decodificación adaptativa: voraz y, si algún segmento cruza un umbral, se repite en haz
+asr_adaptativo = os.environ.get("ELISA_ASR_ADAPTATIVO", "1") == "1"
+asr_umbral_logprob = _env_float("ELISA_ASR_UMBRAL_LOGPROB", -0.8)
+asr_umbral_compresion = _env_float("ELISA_ASR_UMBRAL_COMPRESION", 2.4)
+asr_umbral_no_voz = _env_float("ELISA_ASR_UMBRAL_NO_VOZ", 0.5)
+# Filtro de alucinaciones: se descartan los segmentos que Whisper "oye" en el silencio
+asr_filtro_no_voz = _env_float("ELISA_ASR_FILTRO_NO_VOZ", 0.6)
+asr_filtro_logprob = _env_float("ELISA_ASR_FILTRO_LOGPROB", -1.0)
+asr_filtro_compresion = _env_float("ELISA_ASR_FILTRO_COMPRESION", 2.4)
+# Micro-lotes en el servidor: turnos concurrentes se decodifican juntos (solo backends con lote nativo)
+asr_lote_max = _env_int("ELISA_ASR_LOTE_MAX", 8)
+asr_lote_espera_ms = _env_int("ELISA_ASR_LOTE_ESPERA_MS", 10)
+asr_parcial = os.environ.get("ELISA_ASR_PARCIAL", "1") == "1"
+asr_parcial_intervalo_ms = _env_int("ELISA_ASR_PARCIAL_INTERVALO_MS", 500)
+
+# Interfaz
+gui_fps = _env_int("ELISA_GUI_FPS", 30)                       # repintados por segundo al recibir tokens
+
+# Síntesis de voz
+tts_cola_max = _env_int("ELISA_TTS_COLA_MAX", 2)              # frases sintetizadas por delante
+tts_motor = os.environ.get("ELISA_TTS_MOTOR", "gtts")         # gtts | espeak | piper
+tts_voz = os.environ.get("ELISA_TTS_VOZ") or None
+tts_respaldo = os.environ.get("ELISA_TTS_RESPALDO") or None   # p. ej. gtts; sin él un motor local ausente es un error
+tts_piper_modelo = os.environ.get("ELISA_TTS_PIPER_MODELO")  # ruta al .onnx de la voz
+tts_cache_dir = os.environ.get("ELISA_TTS_CACHE_DIR",
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_tts"))
+tts_cache_mb = _env_int("ELISA_TTS_CACHE_MB", 100)
+tts_cache_memoria_mb = _env_int("ELISA_TTS_CACHE_MEMORIA_MB", 8)
+salida_samplerate = _env_int("ELISA_SALIDA_SAMPLERATE", 24000)  # tasa fija del stream de salida
+
+# Interrupción del asistente por voz (barge-in)
+barge_in = os.environ.get("ELISA_BARGE_IN", "1") == "1"
+barge_in_margen_db = _env_float("ELISA_BARGE_IN_MARGEN_DB", 10.0)  # sobre el eco aprendido
+barge_in_inicio_ms = _env_int("ELISA_BARGE_IN_INICIO_MS", 200)
+barge_in_preroll_ms = _env_int("ELISA_BARGE_IN_PREROLL_MS", 500)
+
+# Manos libres: micrófono siempre abierto a la espera de la palabra clave
+manos_libres = os.environ.get("ELISA_MANOS_LIBRES", "0") == "1"
+palabra_clave = os.environ.get("ELISA_PALABRA_CLAVE", nombre_asistente)
+palabra_clave_umbral = _env_float("ELISA_PALABRA_CLAVE_UMBRAL", 0.35)  # distancia DTW máxima
+# WAV del usuario diciendo la palabra clave; sin ellos se usan plantillas sintetizadas con el TTS
+palabra_clave_plantillas_dir = os.environ.get("ELISA_PALABRA_CLAVE_PLANTILLAS",
+                                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "palabra_clave"))
+palabra_clave_verificar_asr = os.environ.get("ELISA_PALABRA_CLAVE_VERIFICAR_ASR", "1") == "1"
+
+# Sesiones: estado por usuario con expiración y tope de memoria
+_directorio = os.path.dirname(os.path.abspath(__file__))
+sesiones_inactividad_segundos = _env_int("ELISA_SESIONES_INACTIVIDAD_SEGUNDOS", 900)
+sesiones_memoria_mb = _env_int("ELISA_SESIONES_MEMORIA_MB", 256)    # historial + audio pendiente de todas
+sesiones_dir_temporal = os.environ.get("ELISA_SESIONES_DIR_TEMPORAL",
+                                       os.path.join(_directorio, "temp_audio", "sesiones"))
+sesiones_dir_conversaciones = os.environ.get("ELISA_SESIONES_DIR_CONVERSACIONES",
+                                             os.path.join(_directorio, "conversaciones"))
+
+# Servidor HTTP/WebSocket sin interfaz (servidor.py)
+servidor_host = os.environ.get("ELISA_SERVIDOR_HOST", "0.0.0.0")
+servidor_puerto = _env_int("ELISA_SERVIDOR_PUERTO", 8080)
+servidor_workers_asr = _env_int("ELISA_SERVIDOR_WORKERS_ASR", 2)   # decodificaciones simultáneas
+servidor_cola_asr = _env_int("ELISA_SERVIDOR_COLA_ASR", 8)         # turnos en espera antes de responder 503
+servidor_workers_tts = _env_int("ELISA_SERVIDOR_WORKERS_TTS", 4)
+servidor_workers_llm = _env_int("ELISA_SERVIDOR_WORKERS_LLM", 8)   # streams de Ollama abiertos a la vez
+servidor_max_audio_mb = _env_int("ELISA_SERVIDOR_MAX_AUDIO_MB", 20)
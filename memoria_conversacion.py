@@ -0,0 +1,129 @@
+import logging
+import threading
+
+
+def estimar_tokens(texto):
+    # Aproximación para español con tokenizadores BPE (~3.5 caracteres por token)
+    return len(texto) * 2 // 7 + 4
+
+
+class MemoriaConversacion:
+    """Historial para ollama.chat acotado por un presupuesto de tokens
+
+    Los turnos se añaden siempre al final para que el prefijo (sistema + historial) no cambie
+    entre peticiones y Ollama reutilice su caché KV: solo se evalúa el turno nuevo. Cuando el
+    historial supera el presupuesto, los turnos más antiguos se resumen en segundo plano y se
+    sustituyen de una vez por el resumen, que cambia el prefijo una sola vez por tanda.
+    """
+
+    def __init__(self, nombre_asistente, modelo, presupuesto_tokens=1024, fraccion_resumen=0.5,
+                 keep_alive=None):
+        self.nombre_asistente = nombre_asistente
+        self.modelo = modelo
+        self.keep_alive = keep_alive
+        self.presupuesto_tokens = presupuesto_tokens
+        self.fraccion_resumen = fraccion_resumen
+        self.resumen = ""
+        self._turnos = []           # (usuario, asistente, tokens estimados)
+        self._en_resumen = 0        # turnos iniciales que se están resumiendo
+        self._generacion = 0        # cambia al vaciar: invalida los resúmenes en curso
+        self._lock = threading.Lock()
+        self.prompt_eval_total = 0
+        self.turnos_totales = 0
+
+    def sistema_base(self, nombre_usuario=None):
+        """Instrucciones fijas de la conversación, sin el resumen del historial"""
+        partes = [
+            f"Eres {self.nombre_asistente}, un asistente virtual en español. "
+            f"Responde de manera clara y concisa en español (máximo 50 palabras)."
+        ]
+        if nombre_usuario:
+            partes.append(f"El usuario se llama {nombre_usuario}.")
+        return " ".join(partes)
+
+    def sistema(self, nombre_usuario=None):
+        if self.resumen:
+            return f"{self.sistema_base(nombre_usuario)} Resumen de la conversación anterior: {self.resumen}"
+        return self.sistema_base(nombre_usuario)
+
+    @property
+    def hay_historial(self):
+        with self._lock:
+            return bool(self._turnos or self.resumen)
+
+    def mensajes(self, texto, nombre_usuario=None):
+        with self._lock:
+            mensajes = [{"role": "system", "content": self.sistema(nombre_usuario)}]
+            for usuario, asistente, _ in self._turnos:
+                mensajes.append({"role": "user", "content": usuario})
+                mensajes.append({"role": "assistant", "content": asistente})
+        mensajes.append({"role": "user", "content": texto})
+        return mensajes
+
+    @property
+    def tokens_historial(self):
+        with self._lock:
+            return sum(tokens for _, _, tokens in self._turnos)
+
+    def registrar_turno(self, usuario, asistente, metricas=None):
+        with self._lock:
+            self._turnos.append((usuario, asistente, estimar_tokens(usuario) + estimar_tokens(asistente)))
+            self.turnos_totales += 1
+            total = sum(tokens for _, _, tokens in self._turnos)
+            resumir = total > self.presupuesto_tokens and not self._en_resumen
+            if resumir:
+                # Se resume de golpe una fracción del historial, no turno a turno
+                objetivo = total - self.presupuesto_tokens * (1 - self.fraccion_resumen)
+                acumulado = 0
+                while self._en_resumen < len(self._turnos) - 1 and acumulado < objetivo:
+                    acumulado += self._turnos[self._en_resumen][2]
+                    self._en_resumen += 1
+                lote = self._turnos[:self._en_resumen]
+                resumen_previo = self.resumen
+                generacion = self._generacion
+
+        if metricas and metricas.get("prompt_eval_count") is not None:
+            self.prompt_eval_total += metricas["prompt_eval_count"]
+            logging.info(f"LLM: {metricas['prompt_eval_count']} tokens de prompt evaluados "
+                         f"(historial ~{total} tokens, {len(self._turnos)} turnos)")
+        if resumir and lote:
+            threading.Thread(target=self._resumir, args=(lote, resumen_previo, generacion), daemon=True).start()
+
+    def _resumir(self, turnos, resumen_previo, generacion):
+        dialogo = "\n".join(f"Usuario: {u}\n{self.nombre_asistente}: {a}" for u, a, _ in turnos)
+        if resumen_previo:
+            dialogo = f"Resumen previo: {resumen_previo}\n\n{dialogo}"
+        resumen = None
+        try:
+            import ollama
+
+            respuesta = ollama.chat(
+                model=self.modelo,
+                messages=[
+                    {"role": "system", "content": "Resume en español, en menos de 80 palabras, los hechos, "
+                                                  "preferencias y temas de esta conversación que convenga recordar."},
+                    {"role": "user", "content": dialogo}
+                ],
+                # Sin keep_alive la petición acortaría el plazo de descarga del modelo
+                keep_alive=self.keep_alive
+            )
+            resumen = respuesta["message"]["content"].strip()
+        except Exception as e:
+            # Sin resumen se descartan igualmente: el presupuesto manda
+            logging.error(f"Error resumiendo la conversación: {e}")
+
+        with self._lock:
+            if generacion != self._generacion:
+                return
+            del self._turnos[:len(turnos)]
+            self._en_resumen = 0
+            if resumen:
+                self.resumen = resumen
+        logging.info(f"Conversación resumida: {len(turnos)} turnos -> {len(resumen or '')} caracteres")
+
+    def vaciar(self):
+        with self._lock:
+            self._generacion += 1
+            self._turnos = []
+            self._en_resumen = 0
+            self.resumen = ""
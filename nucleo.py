@@ -0,0 +1,310 @@
+import logging
+import threading
+import time
+
+import configuracion
+from asr import TranscriptorIncremental, PoliticaDecodificacion, FiltroSilencio, crear_backend_asr
+from cache_respuestas import CacheRespuestas
+from cache_tts import CacheTTS, MotorConCache
+from captura import DetectorVoz
+from comandos import COMANDOS, RouterComandos
+from memoria_conversacion import MemoriaConversacion
+from procesamiento_audio import procesar_completo, remuestrear
+from tts import crear_motor_tts
+
+
+# Lógica del asistente sin dependencias de Qt: la comparten la GUI y el servidor
+
+RESPUESTA_ERROR = "Lo siento, no pude procesar tu solicitud."
+
+
+def crear_tts():
+    """Motor TTS configurado envuelto en su caché (accesible como .cache)"""
+    motor = crear_motor_tts(
+        configuracion.tts_motor,
+        voz=configuracion.tts_voz,
+        modelo_piper=configuracion.tts_piper_modelo,
+        respaldo=configuracion.tts_respaldo
+    )
+    logging.info(f"Motor TTS: {motor.nombre}")
+    cache = CacheTTS(
+        configuracion.tts_cache_dir,
+        limite_bytes=configuracion.tts_cache_mb * 1024 * 1024,
+        limite_memoria_bytes=configuracion.tts_cache_memoria_mb * 1024 * 1024
+    )
+    return MotorConCache(motor, cache)
+
+
+def crear_cache_respuestas():
+    """Caché de respuestas del LLM configurada, o None si está desactivada"""
+    if not configuracion.llm_cache:
+        return None
+    return CacheRespuestas(
+        configuracion.llm_cache_ruta,
+        ttl_segundos=configuracion.llm_cache_ttl_segundos,
+        max_memoria=configuracion.llm_cache_memoria,
+        max_entradas=configuracion.llm_cache_max_entradas
+    )
+
+
+def cargar_backend_asr(trabajadores=1):
+    backend = crear_backend_asr(configuracion.asr_backend, configuracion.asr_modelo,
+                                configuracion.asr_compute_type, trabajadores=trabajadores)
+    return backend.cargar()
+
+
+def crear_detector(samplerate=None):
+    return DetectorVoz(
+        samplerate or configuracion.asr_samplerate,
+        bloque_ms=configuracion.vad_bloque_ms,
+        umbral_db=configuracion.vad_umbral_db,
+        umbral_min_dbfs=configuracion.vad_umbral_min_dbfs,
+        inicio_ms=configuracion.vad_inicio_ms,
+        silencio_ms=configuracion.vad_silencio_ms
+    )
+
+
+def crear_transcriptor(backend):
+    politica = None
+    if configuracion.asr_adaptativo:
+        politica = PoliticaDecodificacion(configuracion.asr_umbral_logprob,
+                                          configuracion.asr_umbral_compresion,
+                                          configuracion.asr_umbral_no_voz)
+    filtro = FiltroSilencio(configuracion.asr_filtro_no_voz,
+                            configuracion.asr_filtro_logprob,
+                            configuracion.asr_filtro_compresion)
+    return TranscriptorIncremental(backend, configuracion.asr_samplerate, politica=politica, filtro=filtro)
+
+
+def hay_voz(detector):
+    return detector.segundos_voz * 1000 >= configuracion.vad_min_voz_ms
+
+
+def preparar_audio(audio, samplerate):
+    """Lleva una grabación completa a 16 kHz con el frontend; None si no contiene voz suficiente"""
+    audio = remuestrear(audio, samplerate, configuracion.asr_samplerate)
+    # El VAD decide sobre la señal cruda, igual que en la captura en vivo
+    detector = crear_detector()
+    detector.procesar(audio)
+    if not hay_voz(detector):
+        logging.info(f"Turno vacío: {detector.segundos_voz:.2f}s de voz, se omite la transcripción")
+        return None
+    return procesar_completo(audio, configuracion.asr_samplerate, configuracion.asr_samplerate)
+
+
+def limpiar_texto_transcrito(texto):
+    # Las alucinaciones ya las quita FiltroSilencio por segmento; aquí solo se normaliza
+    texto = ' '.join(texto.split())
+    if not any(c.isalnum() for c in texto):
+        return ""
+    return texto.capitalize()
+
+
+def transcribir(transcriptor, audio):
+    """Transcripción final de un turno (float32 mono a 16 kHz) ya limpia"""
+    resultado = transcriptor.finalizar(audio)
+    logging.info(f"ASR {resultado.backend} ({resultado.nivel or 'fijo'}): "
+                 f"{resultado.segundos_decodificacion:.2f}s para "
+                 f"{resultado.duracion_audio:.2f}s de audio (RTF {resultado.rtf or 0:.2f}, "
+                 f"confianza {resultado.confianza or 0:.2f})")
+    return limpiar_texto_transcrito(resultado.texto)
+
+
+def detectar_nombre(texto, nombre_usuario):
+    """Devuelve (nombre_usuario, respuesta); la respuesta solo existe si el nombre es nuevo"""
+    if nombre_usuario is not None:
+        return nombre_usuario, None
+
+    texto_lower = texto.lower()
+    if "me llamo" in texto_lower:
+        nombre_usuario = texto_lower.split("me llamo")[-1].strip().title()
+    elif "mi nombre es" in texto_lower:
+        nombre_usuario = texto_lower.split("mi nombre es")[-1].strip().title()
+    elif "soy" in texto_lower:
+        nombre_usuario = texto_lower.split("soy")[-1].strip().title()
+
+    if nombre_usuario and len(nombre_usuario) > 1:
+        logging.info(f"Nombre detectado: {nombre_usuario}")
+        return nombre_usuario, f"¡Mucho gusto, {nombre_usuario}! ¿En qué puedo ayudarte hoy?"
+    return nombre_usuario, None
+
+
+def generar_tokens(mensajes, modelo, cancelado=lambda: False, metricas=None):
+    """Genera en streaming los fragmentos de texto de la respuesta de Ollama (API de chat)
+
+    Si se pasa `metricas` (dict), al terminar se rellena con los contadores del último fragmento
+    y con los segundos que tardó la respuesta completa.
+    """
+    import ollama
+
+    inicio = time.perf_counter()
+    stream = ollama.chat(
+        model=modelo,
+        messages=mensajes,
+        options={"max_tokens": 50},
+        keep_alive=configuracion.llm_keep_alive,
+        stream=True
+    )
+    primero = True
+    try:
+        for fragmento in stream:
+            if cancelado():
+                logging.info("Generación cancelada")
+                break
+            texto = fragmento["message"]["content"]
+            if texto:
+                if primero:
+                    primero = False
+                    logging.info(f"Primer token en {time.perf_counter() - inicio:.2f}s")
+                yield texto
+            if fragmento.get("done"):
+                final = {campo: fragmento.get(campo) for campo in
+                         ("prompt_eval_count", "eval_count", "prompt_eval_duration", "eval_duration",
+                          "load_duration", "total_duration")}
+                final["segundos"] = time.perf_counter() - inicio  # latencia vista por el usuario
+                logging.info(f"LLM {modelo}: {describir_tiempos(final)}")
+                if metricas is not None:
+                    metricas.update(final)
+    finally:
+        if hasattr(stream, "close"):
+            stream.close()
+
+
+def _segundos(nanosegundos):
+    return (nanosegundos or 0) / 1e9
+
+
+def describir_tiempos(metricas):
+    """Separa la carga del modelo de la evaluación del prompt y de la generación"""
+    return (f"carga {_segundos(metricas.get('load_duration')):.2f}s, "
+            f"prompt {metricas.get('prompt_eval_count') or 0} tokens en "
+            f"{_segundos(metricas.get('prompt_eval_duration')):.2f}s, "
+            f"generación {metricas.get('eval_count') or 0} tokens en "
+            f"{_segundos(metricas.get('eval_duration')):.2f}s")
+
+
+def precargar_llm(modelo, keep_alive):
+    """Carga el modelo en Ollama sin generar nada (prompt vacío); devuelve la duración de la carga"""
+    import ollama
+
+    respuesta = ollama.generate(model=modelo, prompt="", keep_alive=keep_alive)
+    return _segundos(respuesta.get("load_duration"))
+
+
+class MantenedorLLM:
+    """Precarga el modelo al arrancar y lo mantiene cargado mientras haya actividad
+
+    Cada petición a Ollama renueva el plazo de keep_alive; los pings son peticiones vacías
+    que solo lo renuevan, así que no cuestan evaluación.
+    """
+
+    def __init__(self, modelo, keep_alive="30m", intervalo_segundos=240, hay_actividad=lambda: True):
+        self.modelo = modelo
+        self.keep_alive = keep_alive
+        self.intervalo_segundos = intervalo_segundos
+        self.hay_actividad = hay_actividad
+        self.segundos_precarga = None
+        self.pings = 0
+        self.recargas = 0
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def iniciar(self, on_listo=None):
+        def ejecutar():
+            inicio = time.perf_counter()
+            try:
+                carga = precargar_llm(self.modelo, self.keep_alive)
+                self.segundos_precarga = time.perf_counter() - inicio
+                logging.info(f"LLM {self.modelo} precargado en {self.segundos_precarga:.2f}s (carga {carga:.2f}s)")
+                if on_listo:
+                    on_listo(self.segundos_precarga)
+            except Exception as e:
+                logging.error(f"No se pudo precargar el LLM {self.modelo}: {e}")
+            while not self._parar.wait(self.intervalo_segundos):
+                if not self.hay_actividad():
+                    continue
+                try:
+                    carga = precargar_llm(self.modelo, self.keep_alive)
+                    self.pings += 1
+                    # Una carga apreciable significa que Ollama lo había descargado
+                    if carga > 0.5:
+                        self.recargas += 1
+                        logging.warning(f"LLM {self.modelo} recargado en {carga:.2f}s")
+                except Exception as e:
+                    logging.warning(f"Ping al LLM fallido: {e}")
+
+        self._hilo = threading.Thread(target=ejecutar, daemon=True)
+        self._hilo.start()
+        return self._hilo
+
+    def estadisticas(self):
+        return {
+            "segundos_precarga": self.segundos_precarga,
+            "pings": self.pings,
+            "recargas": self.recargas
+        }
+
+    def detener(self):
+        self._parar.set()
+
+
+router_comandos = RouterComandos(COMANDOS)
+# Confirmaciones fijas: se sintetizan al arrancar y se dicen al instante
+CONFIRMACIONES_COMANDOS = [c.confirmacion for c in COMANDOS]
+
+
+def ejecutar_comando(texto, nombre_asistente=None):
+    """Ejecuta la orden reconocida en el texto y devuelve su confirmación, o None si no es una orden"""
+    inicio = time.perf_counter()
+    intencion = router_comandos.resolver(texto, nombre_asistente)
+    if intencion is None:
+        return None
+    logging.info(f"Comando '{intencion.comando.nombre}' reconocido en "
+                 f"{(time.perf_counter() - inicio) * 1000:.1f} ms (distancia {intencion.distancia})")
+    return intencion.ejecutar()
+
+
+class Conversacion:
+    """Estado de una conversación independiente de la interfaz"""
+
+    def __init__(self, nombre_asistente, nombre_usuario=None, modelo=None):
+        self.nombre_asistente = nombre_asistente
+        self.nombre_usuario = nombre_usuario
+        self.mensajes = []
+        self.memoria = MemoriaConversacion(nombre_asistente, modelo or configuracion.llm_modelo,
+                                           configuracion.llm_presupuesto_tokens,
+                                           keep_alive=configuracion.llm_keep_alive)
+
+    def agregar(self, mensaje):
+        self.mensajes.append(mensaje)
+
+    def respuesta_directa(self, texto):
+        """Respuesta que no necesita al LLM (p. ej. al presentarse el usuario) o None"""
+        self.nombre_usuario, respuesta = detectar_nombre(texto, self.nombre_usuario)
+        return respuesta
+
+    def mensajes_chat(self, texto):
+        """Mensajes para ollama.chat: sistema, historial acotado y el turno nuevo"""
+        return self.memoria.mensajes(texto, self.nombre_usuario)
+
+    def contexto_cache(self, texto):
+        """Lo que, además de la pregunta, determina la respuesta: modelo, sistema y usuario; None si
+        la respuesta puede depender del historial y no debe pasar por la caché
+
+        Se usa el sistema sin el resumen: si no, cada resumen cambiaría la clave y la sesión
+        dejaría de acertar.
+        """
+        if self.memoria.hay_historial and CacheRespuestas.depende_del_historial(texto):
+            return None
+        return {
+            "modelo": self.memoria.modelo,
+            "sistema": self.memoria.sistema_base(self.nombre_usuario),
+            "nombre_usuario": self.nombre_usuario
+        }
+
+    def registrar_turno(self, texto, respuesta, metricas=None):
+        self.memoria.registrar_turno(texto, respuesta, metricas)
+
+    def vaciar(self):
+        self.mensajes = []
+        self.memoria.vaciar()
@@ -0,0 +1,235 @@
+import difflib
+import glob
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from asr import OPCIONES_VORACES
+from cache_respuestas import normalizar_pregunta
+from captura import DetectorVoz
+from procesamiento_audio import remuestrear
+
+
+def _filtros_mel(samplerate, n_fft, n_filtros):
+    def a_mel(f):
+        return 2595.0 * np.log10(1.0 + f / 700.0)
+
+    def a_hz(m):
+        return 700.0 * (10.0 ** (m / 2595.0) - 1.0)
+
+    bordes = a_hz(np.linspace(a_mel(60.0), a_mel(samplerate / 2 * 0.95), n_filtros + 2))
+    bins = np.floor((n_fft + 1) * bordes / samplerate).astype(int)
+    filtros = np.zeros((n_filtros, n_fft // 2 + 1), dtype=np.float32)
+    for k in range(n_filtros):
+        izquierda, centro, derecha = bins[k], bins[k + 1], bins[k + 2]
+        for b in range(izquierda, centro):
+            filtros[k, b] = (b - izquierda) / max(1, centro - izquierda)
+        for b in range(centro, derecha):
+            filtros[k, b] = (derecha - b) / max(1, derecha - centro)
+    return filtros
+
+
+class ExtractorMFCC:
+    """MFCC con normalización de media por enunciado (ventanas de 25 ms cada 10 ms)"""
+
+    def __init__(self, samplerate=16000, n_filtros=26, n_coeficientes=13):
+        self.samplerate = samplerate
+        self.ventana = int(samplerate * 0.025)
+        self.salto = int(samplerate * 0.010)
+        self.n_fft = 1 << (self.ventana - 1).bit_length()
+        self.hamming = np.hamming(self.ventana).astype(np.float32)
+        self.filtros = _filtros_mel(samplerate, self.n_fft, n_filtros)
+        n = np.arange(n_filtros)
+        # DCT-II sin el coeficiente 0 (energía), que solo aporta el volumen
+        self.dct = np.cos(np.pi / n_filtros * (n + 0.5)[None, :] * np.arange(1, n_coeficientes)[:, None])
+
+    def extraer(self, audio):
+        audio = np.asarray(audio, dtype=np.float32)
+        if len(audio) < self.ventana:
+            return np.zeros((0, self.dct.shape[0]), dtype=np.float32)
+        audio = np.append(audio[0], audio[1:] - 0.97 * audio[:-1])
+        n_tramas = 1 + (len(audio) - self.ventana) // self.salto
+        indices = np.arange(self.ventana)[None, :] + self.salto * np.arange(n_tramas)[:, None]
+        espectro = np.abs(np.fft.rfft(audio[indices] * self.hamming, self.n_fft)) ** 2
+        mfcc = np.log(espectro @ self.filtros.T + 1e-10) @ self.dct.T
+        mfcc -= mfcc.mean(axis=0)
+        return mfcc.astype(np.float32)
+
+
+def distancia_dtw(plantilla, consulta, inicio_libre):
+    """Coste medio por trama del mejor alineamiento de la plantilla con un prefijo de la consulta
+    y la trama de la consulta en que termina
+
+    Cada paso avanza una trama de plantilla y 0, 1 o 2 de consulta, así que todos los caminos
+    tienen la longitud de la plantilla y cada fila se calcula de una vez con numpy. El inicio es
+    libre en las primeras `inicio_libre` tramas de la consulta y el final, en cualquiera.
+    """
+    if not len(plantilla) or not len(consulta):
+        return np.inf, 0
+    a = plantilla / (np.linalg.norm(plantilla, axis=1, keepdims=True) + 1e-8)
+    b = consulta / (np.linalg.norm(consulta, axis=1, keepdims=True) + 1e-8)
+    coste = 1.0 - a @ b.T   # distancia coseno, en [0, 2]
+
+    fila = np.full(len(consulta), np.inf)
+    fila[:inicio_libre] = coste[0, :inicio_libre]
+    for i in range(1, len(plantilla)):
+        previa = fila
+        fila = previa.copy()
+        fila[1:] = np.minimum(fila[1:], previa[:-1])
+        fila[2:] = np.minimum(fila[2:], previa[:-2])
+        fila += coste[i]
+    final = int(np.argmin(fila))
+    return float(fila[final] / len(plantilla)), final
+
+
+class DetectorPalabraClave:
+    """Comparación por DTW de un fragmento de voz con plantillas de la palabra clave"""
+
+    def __init__(self, plantillas, samplerate=16000, umbral=0.35):
+        self.samplerate = samplerate
+        self.umbral = umbral
+        self.extractor = ExtractorMFCC(samplerate)
+        self.plantillas = [p for p in (self.extractor.extraer(a) for a in plantillas) if len(p)]
+        if not self.plantillas:
+            raise ValueError("No hay plantillas de la palabra clave")
+        # La palabra dicha más despacio que la plantilla más larga no cabe en la ventana
+        self.muestras_ventana = int(max(len(p) for p in self.plantillas) * 1.5 * self.extractor.salto)
+
+    @classmethod
+    def desde_directorio(cls, directorio, samplerate=16000, umbral=0.35, sintetizar=None, palabra=None):
+        """Plantillas grabadas (WAV) en `directorio`; si no hay, se sintetizan con el TTS"""
+        plantillas = []
+        for ruta in sorted(glob.glob(os.path.join(directorio, "*.wav"))):
+            try:
+                import soundfile as sf
+
+                audio, sr = sf.read(ruta, dtype="float32", always_2d=True)
+                plantillas.append(remuestrear(audio.mean(axis=1), sr, samplerate))
+            except Exception as e:
+                logging.error(f"Plantilla de palabra clave ilegible {ruta}: {e}")
+        if not plantillas and sintetizar and palabra:
+            # Voz sintética: sirve para empezar, pero grabar al usuario acierta mucho más
+            for variante in (palabra, f"{palabra}.", f"¡{palabra}!"):
+                audio, sr = sintetizar(variante)
+                plantillas.append(remuestrear(audio, sr, samplerate))
+            logging.info(f"Palabra clave: sin grabaciones en {directorio}, plantillas sintetizadas")
+        return cls([recortar_silencio(p, samplerate) for p in plantillas], samplerate, umbral)
+
+    def puntuar(self, audio):
+        """Mejor puntuación entre las plantillas y la muestra de `audio` en que acaba la palabra"""
+        consulta = self.extractor.extraer(audio)
+        inicio_libre = max(1, int(0.2 * self.samplerate / self.extractor.salto))
+        puntuacion, trama = min(distancia_dtw(p, consulta, inicio_libre) for p in self.plantillas)
+        return puntuacion, min(len(audio), trama * self.extractor.salto + self.extractor.ventana)
+
+    def detectar(self, audio):
+        puntuacion, fin = self.puntuar(audio)
+        return puntuacion <= self.umbral, puntuacion, fin
+
+
+def crear_verificador_asr(backend, palabra, similitud=0.75):
+    """Segunda opinión del ASR sobre un candidato: solo se decodifica cuando el DTW ya acertó"""
+    objetivo = normalizar_pregunta(palabra)
+
+    def verificar(audio):
+        texto = normalizar_pregunta(backend.transcribir(audio, OPCIONES_VORACES).texto)
+        return any(difflib.SequenceMatcher(None, objetivo, p).ratio() >= similitud for p in texto.split()[:3])
+
+    return verificar
+
+
+def recortar_silencio(audio, samplerate, margen_db=30.0, bloque_ms=10):
+    """Quita el silencio de los extremos (lo que queda más de margen_db por debajo del pico)"""
+    bloque = max(1, int(samplerate * bloque_ms / 1000))
+    n = len(audio) // bloque
+    if not n:
+        return audio
+    energia = 10.0 * np.log10(np.mean(np.square(audio[:n * bloque].reshape(n, bloque)), axis=1) + 1e-12)
+    voz = np.flatnonzero(energia > energia.max() - margen_db)
+    return audio[voz[0] * bloque:(voz[-1] + 1) * bloque]
+
+
+class EscuchaPalabraClave:
+    """Espera la palabra clave sobre la captura compartida sin gastar CPU en reposo
+
+    Por cada bloque solo se calcula su energía; cuando empieza una ráfaga de voz se compara su
+    principio con las plantillas (una vez por ráfaga). Al detectarla se entrega la posición de
+    la captura en que termina, para que la grabación del turno empiece justo ahí.
+    """
+
+    def __init__(self, detector_clave, detector_voz, preroll_ms=300, verificar=None):
+        self.detector_clave = detector_clave
+        self.detector_voz = detector_voz
+        self.samplerate = detector_voz.samplerate
+        self.preroll = int(self.samplerate * preroll_ms / 1000)
+        self.verificar = verificar
+        self.activa = threading.Event()
+        self.activa.set()
+        self.candidatos = 0
+        self.detecciones = 0
+        self.rechazos_asr = 0
+
+    def ejecutar(self, captura, on_deteccion, debe_continuar=lambda: True):
+        """Bloquea mientras debe_continuar(); on_deteccion(posicion) recibe la posición de
+        `captura` en que termina la palabra clave"""
+        bloque = self.detector_voz.bloque
+        with captura.lector() as lector:
+            inicio_rafaga = None
+            evaluada = False
+            while debe_continuar():
+                nuevo = lector.siguiente()
+                if nuevo is None:
+                    continue
+
+                if not self.activa.is_set():
+                    # En pausa (grabando o hablando) solo se avanza el cursor de lectura
+                    lector.saltar()
+                    inicio_rafaga, evaluada = None, False
+                    self.detector_voz.reiniciar()
+                    continue
+
+                evento = self.detector_voz.procesar(nuevo)
+                leido = lector.posicion
+                if evento == DetectorVoz.INICIO and inicio_rafaga is None:
+                    # El VAD declara el inicio tras inicio_ms de voz: se retrocede eso y el pre-roll
+                    retraso = self.detector_voz.bloques_inicio * bloque
+                    inicio_rafaga = max(0, leido - retraso - self.preroll)
+                if inicio_rafaga is None:
+                    continue
+
+                if not evaluada:
+                    completa = leido - inicio_rafaga >= self.detector_clave.muestras_ventana + self.preroll
+                    if completa or evento == DetectorVoz.FIN:
+                        evaluada = True
+                        fin_clave = self._evaluar(captura, inicio_rafaga)
+                        if fin_clave is not None:
+                            on_deteccion(fin_clave)
+                if evento == DetectorVoz.FIN:
+                    inicio_rafaga, evaluada = None, False
+
+    def _evaluar(self, captura, inicio):
+        """Posición en que termina la palabra clave si la ráfaga empieza por ella, o None"""
+        self.candidatos += 1
+        ventana = captura.leer(inicio, inicio + self.detector_clave.muestras_ventana + self.preroll)
+        t0 = time.perf_counter()
+        detectada, puntuacion, fin = self.detector_clave.detectar(ventana)
+        logging.debug(f"Palabra clave: puntuación {puntuacion:.3f} en {(time.perf_counter() - t0) * 1000:.1f} ms")
+        if not detectada:
+            return None
+        if self.verificar is not None and not self.verificar(ventana[:fin]):
+            self.rechazos_asr += 1
+            logging.info(f"Palabra clave descartada por el ASR (puntuación {puntuacion:.3f})")
+            return None
+        self.detecciones += 1
+        logging.info(f"Palabra clave detectada (puntuación {puntuacion:.3f})")
+        return inicio + fin
+
+    def estadisticas(self):
+        return {
+            "candidatos": self.candidatos,
+            "detecciones": self.detecciones,
+            "rechazos_asr": self.rechazos_asr
+        }
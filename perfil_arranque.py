@@ -0,0 +1,24 @@
+import logging
+import time
+
+# Se importa antes que cualquier otro módulo pesado: este es el instante cero
+_inicio = time.perf_counter()
+_marcas = []
+
+
+def marcar(etapa, duracion=None):
+    """Registra cuándo terminó una etapa del arranque (y su duración si corrió en paralelo)"""
+    _marcas.append((time.perf_counter() - _inicio, etapa, duracion))
+
+
+def informe():
+    lineas = ["Perfil de arranque:"]
+    anterior = 0.0
+    for instante, etapa, duracion in sorted(_marcas):
+        if duracion is None:
+            detalle = f"+{instante - anterior:.2f}s"
+            anterior = instante
+        else:
+            detalle = f"{duracion:.2f}s en segundo plano"
+        lineas.append(f"  {etapa:<28} {instante:7.2f}s  ({detalle})")
+    logging.info("\n".join(lineas))
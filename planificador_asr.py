@@ -0,0 +1,136 @@
+import collections
+import logging
+import threading
+import time
+
+import numpy as np
+
+from asr import OPCIONES_FINALES
+
+
+class _Peticion:
+    def __init__(self, audio, opciones, contexto):
+        self.audio = audio
+        self.opciones = opciones
+        self.contexto = contexto
+        # Solo comparten lote las peticiones que se decodifican igual
+        self.clave = (tuple(sorted(opciones.items())), contexto)
+        self.llegada = time.perf_counter()
+        self.hecho = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class PlanificadorASR:
+    """Agrupa en micro-lotes las transcripciones concurrentes y las decodifica juntas
+
+    Expone la misma interfaz que un backend (transcribir), así que puede envolver
+    a cualquiera; el beneficio real llega con los que implementan transcribir_lote.
+    Los resultados son los de transcribir_lote del backend, que pueden diferir de los de
+    transcribir (en Whisper: sin marcas de tiempo y con un único segmento).
+    """
+
+    def __init__(self, backend, max_lote=8, espera_ms=10):
+        self.backend = backend
+        self.nombre = backend.nombre
+        self.samplerate = backend.samplerate
+        self.max_lote = max_lote
+        self.espera = espera_ms / 1000
+        self._cola = collections.deque()
+        self._condicion = threading.Condition()
+        self._cerrado = False
+        self.lotes = 0
+        self.peticiones = 0
+        self.lote_maximo = 0
+        self.espera_maxima = 0.0
+        self._espera_total = 0.0
+        self.profundidad_maxima = 0
+        self._hilo = threading.Thread(target=self._despachar, daemon=True)
+        self._hilo.start()
+
+    def transcribir(self, audio, opciones=None, contexto=None):
+        """Bloquea al llamante hasta que el lote que contiene su audio se haya decodificado"""
+        peticion = _Peticion(np.ascontiguousarray(audio, dtype=np.float32), opciones or OPCIONES_FINALES, contexto)
+        with self._condicion:
+            if self._cerrado:
+                raise RuntimeError("Planificador ASR cerrado")
+            self._cola.append(peticion)
+            self.profundidad_maxima = max(self.profundidad_maxima, len(self._cola))
+            self._condicion.notify()
+        peticion.hecho.wait()
+        if peticion.error is not None:
+            raise peticion.error
+        return peticion.resultado
+
+    def _siguiente_lote(self):
+        with self._condicion:
+            while not self._cola and not self._cerrado:
+                self._condicion.wait()
+            if not self._cola:
+                return None
+
+            # Se espera a que se llene el lote como mucho `espera` desde la llegada de la más antigua
+            primera = self._cola[0]
+            limite = primera.llegada + self.espera
+            while True:
+                compatibles = [p for p in self._cola if p.clave == primera.clave]
+                restante = limite - time.perf_counter()
+                if len(compatibles) >= self.max_lote or restante <= 0 or self._cerrado:
+                    break
+                self._condicion.wait(restante)
+
+            lote = compatibles[:self.max_lote]
+            for peticion in lote:
+                self._cola.remove(peticion)
+            return lote
+
+    def _despachar(self):
+        while True:
+            lote = self._siguiente_lote()
+            if lote is None:
+                return
+            ahora = time.perf_counter()
+            esperas = [ahora - p.llegada for p in lote]
+            try:
+                resultados = self.backend.transcribir_lote([p.audio for p in lote], lote[0].opciones,
+                                                           lote[0].contexto)
+                for peticion, resultado in zip(lote, resultados):
+                    peticion.resultado = resultado
+            except Exception as e:
+                logging.error(f"Error decodificando lote ASR de {len(lote)}: {e}", exc_info=True)
+                for peticion in lote:
+                    peticion.error = e
+            finally:
+                for peticion in lote:
+                    peticion.hecho.set()
+
+            self.lotes += 1
+            self.peticiones += len(lote)
+            self.lote_maximo = max(self.lote_maximo, len(lote))
+            self.espera_maxima = max(self.espera_maxima, max(esperas))
+            self._espera_total += sum(esperas)
+            logging.debug(f"Lote ASR de {len(lote)} en {time.perf_counter() - ahora:.2f}s "
+                          f"(espera máx. {max(esperas) * 1000:.0f} ms, {self.profundidad} en cola)")
+
+    @property
+    def profundidad(self):
+        with self._condicion:
+            return len(self._cola)
+
+    def estadisticas(self):
+        return {
+            "lotes": self.lotes,
+            "peticiones": self.peticiones,
+            "lote_medio": self.peticiones / self.lotes if self.lotes else 0.0,
+            "lote_maximo": self.lote_maximo,
+            "espera_media_ms": self._espera_total / self.peticiones * 1000 if self.peticiones else 0.0,
+            "espera_maxima_ms": self.espera_maxima * 1000,
+            "profundidad": self.profundidad,
+            "profundidad_maxima": self.profundidad_maxima
+        }
+
+    def cerrar(self):
+        with self._condicion:
+            self._cerrado = True
+            self._condicion.notify_all()
+        self._hilo.join(timeout=1)
@@ -0,0 +1,198 @@
+import math
+import time
+
+import numpy as np
+
+
+class Remuestreador:
+    """Remuestreo polifásico (sinc con ventana Kaiser) que conserva estado entre bloques"""
+
+    def __init__(self, samplerate_origen, samplerate_destino, taps_por_fase=16, beta=8.0):
+        divisor = math.gcd(int(samplerate_origen), int(samplerate_destino))
+        self.up = int(samplerate_destino) // divisor
+        self.down = int(samplerate_origen) // divisor
+
+        n_taps = taps_por_fase * self.up
+        corte = 1.0 / max(self.up, self.down)
+        t = np.arange(n_taps) - (n_taps - 1) / 2
+        h = np.sinc(corte * t) * corte * np.kaiser(n_taps, beta) * self.up
+        # fases[p, k] = h[p + k * up]: cada salida usa una sola fase
+        self.fases = h.reshape(taps_por_fase, self.up).T.astype(np.float32)
+        self.taps = taps_por_fase
+        self.retardo = (n_taps - 1) // 2
+        self.reiniciar()
+
+    def reiniciar(self):
+        self._historia = np.zeros(0, dtype=np.float32)
+        self._inicio = 0        # índice absoluto de la primera muestra guardada
+        self._siguiente = 0     # índice de la próxima muestra de salida
+
+    def procesar(self, bloque):
+        if self.up == self.down:
+            return np.asarray(bloque, dtype=np.float32)
+        self._historia = np.concatenate((self._historia, np.asarray(bloque, dtype=np.float32)))
+        disponibles = self._inicio + len(self._historia)
+
+        # Última salida calculable: su muestra base debe estar ya recibida
+        ultima = ((disponibles - 1) * self.up - self.retardo) // self.down
+        if ultima < self._siguiente:
+            return np.zeros(0, dtype=np.float32)
+
+        n = np.arange(self._siguiente, ultima + 1)
+        pos = n * self.down + self.retardo
+        base = pos // self.up
+        fase = pos % self.up
+        indices = base[:, None] - np.arange(self.taps)[None, :] - self._inicio
+        validos = indices >= 0
+        muestras = self._historia[np.clip(indices, 0, None)] * validos
+        salida = np.einsum('ij,ij->i', muestras, self.fases[fase]).astype(np.float32)
+
+        self._siguiente = ultima + 1
+        necesario = (self._siguiente * self.down + self.retardo) // self.up - self.taps + 1
+        recorte = max(0, min(necesario - self._inicio, len(self._historia)))
+        self._historia = self._historia[recorte:]
+        self._inicio += recorte
+        return salida
+
+
+def remuestrear(audio, samplerate_origen, samplerate_destino):
+    """Remuestrea una señal completa de una sola vez"""
+    if samplerate_origen == samplerate_destino:
+        return np.asarray(audio, dtype=np.float32)
+    r = Remuestreador(samplerate_origen, samplerate_destino)
+    longitud = int(math.ceil(len(audio) * r.up / r.down))
+    relleno = np.zeros(r.taps * r.down // r.up + r.taps + 1, dtype=np.float32)
+    salida = np.concatenate((r.procesar(audio), r.procesar(relleno)))
+    return salida[:longitud]
+
+
+class FrontendAudio:
+    """Cadena incremental por bloques: paso alto, supresión espectral de ruido y AGC por RMS"""
+
+    def __init__(self, samplerate=16000, trama=512, salto=256, corte_hz=80.0,
+                 sobresustraccion=1.5, ganancia_min_db=-20.0, objetivo_dbfs=-20.0,
+                 ganancia_max_db=20.0):
+        self.samplerate = samplerate
+        self.trama = trama
+        self.salto = salto
+        self.ventana = np.sqrt(np.hanning(trama + 1)[:-1]).astype(np.float32)
+        frecuencias = np.fft.rfftfreq(trama, 1.0 / samplerate)
+        self.paso_alto = (frecuencias >= corte_hz).astype(np.float32)
+        self.sobresustraccion = sobresustraccion
+        self.ganancia_min = 10 ** (ganancia_min_db / 20)
+        self.objetivo_rms = 10 ** (objetivo_dbfs / 20)
+        self.ganancia_max = 10 ** (ganancia_max_db / 20)
+        self.reiniciar()
+
+    def reiniciar(self):
+        self._entrada = np.zeros(self.trama - self.salto, dtype=np.float32)
+        self._solape = np.zeros(self.trama - self.salto, dtype=np.float32)
+        self.ruido = None
+        self.ganancia_agc = 1.0
+
+    def procesar(self, bloque):
+        """Procesa un bloque mono y devuelve las muestras ya disponibles (latencia de una trama)"""
+        self._entrada = np.concatenate((self._entrada, np.asarray(bloque, dtype=np.float32).reshape(-1)))
+        n_tramas = (len(self._entrada) - self.trama) // self.salto + 1
+        if n_tramas <= 0:
+            return np.zeros(0, dtype=np.float32)
+
+        tramas = np.lib.stride_tricks.sliding_window_view(self._entrada, self.trama)[::self.salto][:n_tramas]
+        espectro = np.fft.rfft(tramas * self.ventana, axis=1)
+        potencia = espectro.real ** 2 + espectro.imag ** 2
+
+        if self.ruido is None:
+            self.ruido = np.percentile(potencia, 10, axis=0) + 1e-10
+        ganancia = np.maximum(1.0 - self.sobresustraccion * self.ruido / (potencia + 1e-10), self.ganancia_min)
+        espectro *= ganancia * self.paso_alto
+
+        # Las tramas cercanas al piso de ruido actualizan la estimación
+        ruidosas = potencia.mean(axis=1) < 2.0 * self.ruido.mean()
+        if ruidosas.any():
+            self.ruido = 0.9 * self.ruido + 0.1 * potencia[ruidosas].mean(axis=0)
+
+        tiempo = np.fft.irfft(espectro, n=self.trama, axis=1).astype(np.float32) * self.ventana
+        salida = np.zeros(n_tramas * self.salto + self.trama - self.salto, dtype=np.float32)
+        salida[:len(self._solape)] = self._solape
+        for i in range(0, self.trama, self.salto):
+            # Superposición-suma vectorizada por desplazamiento de salto
+            salida[i:i + n_tramas * self.salto] += tiempo[:, i:i + self.salto].reshape(-1)
+        listas = n_tramas * self.salto
+        self._solape = salida[listas:]
+        self._entrada = self._entrada[listas:]
+        return self._agc(salida[:listas], ruidosas.all())
+
+    def finalizar(self):
+        """Vacía la latencia interna al terminar la captura"""
+        resto = self.procesar(np.zeros(self.trama, dtype=np.float32))
+        self._entrada = np.zeros(self.trama - self.salto, dtype=np.float32)
+        self._solape = np.zeros(self.trama - self.salto, dtype=np.float32)
+        return resto
+
+    def _agc(self, audio, solo_ruido):
+        if not len(audio):
+            return audio
+        anterior = self.ganancia_agc
+        if not solo_ruido:
+            rms = float(np.sqrt(np.mean(np.square(audio))))
+            deseada = min(self.objetivo_rms / max(rms, 1e-6), self.ganancia_max)
+            # Ataque rápido al bajar, liberación lenta al subir
+            coef = 0.5 if deseada < anterior else 0.1
+            self.ganancia_agc = anterior + coef * (deseada - anterior)
+        rampa = np.linspace(anterior, self.ganancia_agc, len(audio), dtype=np.float32)
+        return np.clip(audio * rampa, -1.0, 1.0)
+
+
+def procesar_completo(audio, samplerate_origen, samplerate=16000):
+    """Aplica remuestreo y frontend a una grabación completa"""
+    audio = np.asarray(audio, dtype=np.float32)
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    audio = remuestrear(audio, samplerate_origen, samplerate)
+    frontend = FrontendAudio(samplerate)
+    latencia = frontend.trama - frontend.salto
+    salida = np.concatenate((frontend.procesar(audio), frontend.finalizar()))
+    return salida[latencia:latencia + len(audio)]
+
+
+def _benchmark(segundos=10.0, bloque_ms=30, repeticiones=5):
+    rng = np.random.default_rng(0)
+    sr_origen = 44100
+    t = np.arange(int(segundos * sr_origen)) / sr_origen
+    audio = (0.3 * np.sin(2 * np.pi * 220 * t) * (np.sin(2 * np.pi * 0.5 * t) > 0)
+             + 0.01 * rng.standard_normal(len(t))).astype(np.float32)
+
+    def medir(nombre, funcion):
+        mejor = min(_cronometrar(funcion) for _ in range(repeticiones))
+        print(f"{nombre:<45} {1000 * mejor / segundos:8.3f} ms por segundo de audio")
+
+    def anterior():
+        x = audio / np.max(np.abs(audio))
+        np.convolve(x, np.ones(5) / 5, mode='same')
+
+    def por_bloques(sr):
+        def ejecutar():
+            r = Remuestreador(sr_origen, 16000)
+            f = FrontendAudio(16000)
+            paso = int(sr_origen * bloque_ms / 1000)
+            for i in range(0, len(audio), paso):
+                f.procesar(r.procesar(audio[i:i + paso]))
+        return ejecutar
+
+    medir("mejorar_calidad_audio (44.1 kHz, anterior)", anterior)
+    medir("remuestreo 44.1 -> 16 kHz (completo)", lambda: remuestrear(audio, sr_origen, 16000))
+    medir("remuestreo + frontend (completo)", lambda: procesar_completo(audio, sr_origen))
+    medir(f"remuestreo + frontend (bloques de {bloque_ms} ms)", por_bloques(sr_origen))
+    audio16 = remuestrear(audio, sr_origen, 16000)
+    medir("frontend a 16 kHz nativo (completo)",
+          lambda: FrontendAudio(16000).procesar(audio16))
+
+
+def _cronometrar(funcion):
+    inicio = time.perf_counter()
+    funcion()
+    return time.perf_counter() - inicio
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,269 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from asr import OPCIONES_FINALES, crear_backend_asr
+
+
+class ASRCancelado(Exception):
+    """La transcripción se canceló antes de terminar"""
+
+
+def _adjuntar_memoria(nombre):
+    # El bloque es del padre: solo él lo borra (antes de 3.13 no hay track, pero el hijo
+    # comparte el resource_tracker del padre y registrarlo de nuevo no tiene efecto)
+    try:
+        return shared_memory.SharedMemory(name=nombre, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=nombre)
+
+
+def _principal(conexion, nombre_backend, modelo, compute_type, idioma):
+    """Bucle del proceso hijo: carga el modelo y transcribe lo que el padre deja en memoria compartida"""
+    try:
+        backend = crear_backend_asr(nombre_backend, modelo, compute_type, idioma).cargar()
+    except Exception as e:
+        conexion.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conexion.send(("listo", backend.tiempos))
+
+    memoria = None
+    while True:
+        try:
+            peticion = conexion.recv()
+        except EOFError:
+            break
+        if peticion is None:
+            break
+        nombre, muestras, opciones, contexto = peticion
+        try:
+            if memoria is None or memoria.name != nombre:
+                if memoria is not None:
+                    memoria.close()
+                memoria = _adjuntar_memoria(nombre)
+            audio = np.ndarray((muestras,), dtype=np.float32, buffer=memoria.buf)
+            resultado = backend.transcribir(audio, opciones, contexto)
+            del audio
+            conexion.send(("resultado", resultado))
+        except Exception as e:
+            conexion.send(("error", f"{type(e).__name__}: {e}"))
+    if memoria is not None:
+        memoria.close()
+
+
+class _ProcesoASR:
+    """Un proceso hijo con su canal y su bloque de memoria compartida para el audio"""
+
+    def __init__(self, indice, contexto_mp, argumentos, capacidad_muestras):
+        self.indice = indice
+        self.contexto_mp = contexto_mp
+        self.argumentos = argumentos
+        self.memoria = shared_memory.SharedMemory(create=True, size=capacidad_muestras * 4)
+        self.capacidad = capacidad_muestras
+        self.proceso = None
+        self.conexion = None
+        self.listo = False
+        self.tiempos = {}
+        self.arrancar()
+
+    def arrancar(self):
+        self.conexion, extremo_hijo = self.contexto_mp.Pipe()
+        self.proceso = self.contexto_mp.Process(target=_principal, args=(extremo_hijo, *self.argumentos),
+                                                name=f"asr-{self.indice}", daemon=True)
+        self.proceso.start()
+        extremo_hijo.close()
+        self.listo = False
+        self.canal_cerrado = False
+
+    def reiniciar(self):
+        """Mata el proceso (aunque esté decodificando) y arranca otro; el modelo se recarga en segundo plano"""
+        self.conexion.close()
+        if self.proceso.is_alive():
+            self.proceso.kill()
+        self.proceso.join(timeout=5)
+        self.arrancar()
+
+    def enviar(self, audio, opciones, contexto):
+        if len(audio) > self.capacidad:
+            # Se sustituye por un bloque mayor; el hijo se adjunta al nuevo por su nombre
+            self.memoria.close()
+            self.memoria.unlink()
+            self.capacidad = len(audio)
+            self.memoria = shared_memory.SharedMemory(create=True, size=self.capacidad * 4)
+        np.ndarray((len(audio),), dtype=np.float32, buffer=self.memoria.buf)[:] = audio
+        self.conexion.send((self.memoria.name, len(audio), opciones, contexto))
+
+    def recibir(self, timeout):
+        """Siguiente respuesta del hijo, o None si no llegó en `timeout`"""
+        while self.conexion.poll(timeout):
+            try:
+                tipo, valor = self.conexion.recv()
+            except (EOFError, OSError):
+                # El hijo murió: se deja que termine de salir para que is_alive() lo refleje
+                self.canal_cerrado = True
+                self.proceso.join(timeout=1)
+                return None
+            if tipo == "listo":
+                self.listo = True
+                self.tiempos = valor
+                continue
+            if tipo == "error":
+                raise RuntimeError(f"Proceso ASR {self.indice}: {valor}")
+            return valor
+        return None
+
+    @property
+    def caido(self):
+        return self.canal_cerrado or not self.proceso.is_alive()
+
+    def esperar_carga(self):
+        while not self.listo:
+            self.recibir(0.1)
+            if not self.listo and self.caido:
+                raise RuntimeError(f"El proceso ASR {self.indice} terminó al cargar el modelo")
+
+    def cerrar(self):
+        try:
+            self.conexion.send(None)
+        except (OSError, ValueError):
+            pass
+        self.proceso.join(timeout=2)
+        if self.proceso.is_alive():
+            self.proceso.kill()
+        self.conexion.close()
+        self.memoria.close()
+        self.memoria.unlink()
+
+
+class ServicioASRProcesos:
+    """Reconocimiento de voz en procesos aparte para que el GIL de la decodificación no frene la GUI
+
+    El audio pasa por memoria compartida (sin serializar el array) y por el canal solo viajan
+    las opciones y el resultado. Una transcripción cancelada o un proceso caído se resuelven
+    matando el proceso y arrancando otro.
+    """
+
+    def __init__(self, nombre_backend, modelo="small", compute_type="int8", idioma="es",
+                 procesos=1, max_segundos=30.0, samplerate=16000):
+        self.nombre = f"{nombre_backend} ({procesos} proc.)"
+        self.samplerate = samplerate
+        self._argumentos = (nombre_backend, modelo, compute_type, idioma)
+        self._n_procesos = max(1, procesos)
+        self._capacidad = int(max_segundos * samplerate)
+        self._procesos = []
+        self._libres = queue.Queue()
+        self.tiempos = {}
+        self.peticiones = 0
+        self.canceladas = 0
+        self.caidas = 0
+
+    def cargar(self):
+        # spawn: el hijo no hereda hilos de PyTorch ni de audio a medio usar. Sí reimporta el
+        # script principal como __mp_main__, que por eso no debe inicializar nada al importarse
+        contexto_mp = multiprocessing.get_context("spawn")
+        inicio = time.perf_counter()
+        self._procesos = [_ProcesoASR(i, contexto_mp, self._argumentos, self._capacidad)
+                          for i in range(self._n_procesos)]
+        try:
+            for proceso in self._procesos:
+                proceso.esperar_carga()
+        except Exception:
+            self.cerrar()
+            raise
+        # Los procesos cargan en paralelo: cuenta el más lento de cada paso
+        self.tiempos = {paso: max(p.tiempos.get(paso, 0.0) for p in self._procesos) for paso in ("importar", "cargar")}
+        for proceso in self._procesos:
+            self._libres.put(proceso)
+        logging.info(f"ASR en {self._n_procesos} proceso(s) listo en {time.perf_counter() - inicio:.2f}s")
+        return self
+
+    def cliente(self):
+        """Vista con su propia cancelación: cancelar un cliente no afecta a los demás"""
+        return ClienteASR(self)
+
+    def transcribir(self, audio, opciones=None, contexto=None):
+        return self._transcribir(audio, opciones, contexto, threading.Event())
+
+    def transcribir_lote(self, audios, opciones=None, contexto=None):
+        return [self.transcribir(audio, opciones, contexto) for audio in audios]
+
+    def _transcribir(self, audio, opciones, contexto, cancelado):
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        proceso = None
+        while proceso is None:
+            if cancelado.is_set():
+                raise ASRCancelado()
+            try:
+                proceso = self._libres.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+        self.peticiones += 1
+        try:
+            if proceso.caido:
+                # Murió en reposo (sin petición en curso): se repone antes de usarlo
+                self._reponer(proceso)
+            try:
+                proceso.enviar(audio, opciones or OPCIONES_FINALES, contexto)
+            except (OSError, ValueError):
+                self._reponer(proceso)
+                raise RuntimeError("El proceso ASR no estaba disponible; se reinicia")
+            while True:
+                resultado = proceso.recibir(0.05)
+                if resultado is not None:
+                    return resultado
+                if cancelado.is_set():
+                    self.canceladas += 1
+                    logging.info(f"Transcripción cancelada: se reinicia el proceso ASR {proceso.indice}")
+                    proceso.reiniciar()
+                    raise ASRCancelado()
+                if proceso.caido:
+                    self._reponer(proceso)
+                    raise RuntimeError("El proceso ASR se cayó durante la transcripción")
+        finally:
+            self._libres.put(proceso)
+
+    def _reponer(self, proceso):
+        """Reinicia un proceso caído y espera a que vuelva a tener el modelo cargado"""
+        self.caidas += 1
+        logging.error(f"El proceso ASR {proceso.indice} terminó con código {proceso.proceso.exitcode}; se reinicia")
+        proceso.reiniciar()
+        proceso.esperar_carga()
+
+    def estadisticas(self):
+        return {
+            "procesos": self._n_procesos,
+            "peticiones": self.peticiones,
+            "canceladas": self.canceladas,
+            "caidas": self.caidas
+        }
+
+    def cerrar(self):
+        for proceso in self._procesos:
+            proceso.cerrar()
+        self._procesos = []
+
+
+class ClienteASR:
+    """Interfaz de backend sobre un ServicioASRProcesos con cancelación propia"""
+
+    def __init__(self, servicio):
+        self.servicio = servicio
+        self.nombre = servicio.nombre
+        self.samplerate = servicio.samplerate
+        self._cancelado = threading.Event()
+
+    def transcribir(self, audio, opciones=None, contexto=None):
+        return self.servicio._transcribir(audio, opciones, contexto, self._cancelado)
+
+    def transcribir_lote(self, audios, opciones=None, contexto=None):
+        return [self.transcribir(audio, opciones, contexto) for audio in audios]
+
+    def cancelar(self):
+        """Interrumpe la transcripción en curso (y las siguientes) de este cliente"""
+        self._cancelado.set()
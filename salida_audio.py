@@ -0,0 +1,182 @@
+import collections
+import heapq
+import io
+import itertools
+import logging
+import queue
+import threading
+
+import numpy as np
+
+from procesamiento_audio import remuestrear
+
+
+PRIORIDAD_ALTA = 0
+PRIORIDAD_NORMAL = 1
+
+
+def decodificar_audio(datos):
+    """Decodifica audio codificado (MP3/WAV) en memoria a PCM float32 mono"""
+    import soundfile as sf
+
+    pcm, samplerate = sf.read(io.BytesIO(datos), dtype="float32", always_2d=True)
+    return pcm.mean(axis=1), samplerate
+
+
+class Enunciado:
+    def __init__(self, pcm, prioridad, turno, on_inicio=None, on_fin=None):
+        self.pcm = pcm
+        self.prioridad = prioridad
+        self.turno = turno
+        self.on_inicio = on_inicio
+        self.on_fin = on_fin
+
+
+class ServicioSalidaAudio:
+    """Salida de audio única y persistente con cola de prioridad de enunciados"""
+
+    def __init__(self, samplerate=24000, bloque=1024):
+        self.samplerate = samplerate
+        self.bloque = bloque
+        self.stream = None
+        self._lock = threading.Lock()
+        self._cola = []                     # heap de (prioridad, secuencia, enunciado)
+        self._secuencia = itertools.count()
+        self._actual = None
+        self._posicion = 0
+        self._eventos = queue.Queue()
+        self._despachador = None
+        # Niveles de los últimos bloques emitidos: referencia para la puerta de eco
+        self._niveles = collections.deque(maxlen=8)
+        self.underruns = 0
+        self.reproducidos = 0
+        self.cancelados = 0
+
+    def abrir(self):
+        if self.stream is not None:
+            return
+        import sounddevice as sd
+
+        # Los callbacks de usuario se ejecutan fuera del hilo de audio
+        self._despachador = threading.Thread(target=self._despachar, daemon=True)
+        self._despachador.start()
+        self.stream = sd.OutputStream(
+            samplerate=self.samplerate,
+            channels=1,
+            dtype="float32",
+            blocksize=self.bloque,
+            callback=self._callback
+        )
+        self.stream.start()
+
+    def preparar(self, pcm, samplerate):
+        """Lleva el PCM a la tasa del stream para que el callback no tenga trabajo pendiente"""
+        return np.ascontiguousarray(remuestrear(pcm, samplerate, self.samplerate), dtype=np.float32)
+
+    def encolar(self, pcm, prioridad=PRIORIDAD_NORMAL, turno=None, interrumpir=False,
+                on_inicio=None, on_fin=None):
+        """Añade un enunciado; con interrumpir=True se descarta todo lo que esté sonando o en cola"""
+        enunciado = Enunciado(pcm, prioridad, turno, on_inicio, on_fin)
+        with self._lock:
+            if interrumpir:
+                self._descartar(lambda e: True)
+            heapq.heappush(self._cola, (prioridad, next(self._secuencia), enunciado))
+            profundidad = len(self._cola)
+        logging.debug(f"Salida de audio: {profundidad} enunciados en cola")
+        return enunciado
+
+    def cancelar_turno(self, turno):
+        with self._lock:
+            self._descartar(lambda e: e.turno is turno)
+
+    def detener(self):
+        with self._lock:
+            self._descartar(lambda e: True)
+
+    def _descartar(self, criterio):
+        if self._actual is not None and criterio(self._actual):
+            self._eventos.put(("fin", self._actual, True))
+            self._actual = None
+        conservados = []
+        for item in self._cola:
+            if criterio(item[2]):
+                self._eventos.put(("fin", item[2], True))
+            else:
+                conservados.append(item)
+        heapq.heapify(conservados)
+        self._cola = conservados
+
+    def _callback(self, outdata, frames, tiempo, status):
+        if status.output_underflow:
+            self.underruns += 1
+        escrito = 0
+        with self._lock:
+            while escrito < frames:
+                if self._actual is None:
+                    if not self._cola:
+                        break
+                    # El siguiente enunciado empieza en el mismo bloque: sin huecos
+                    self._actual = heapq.heappop(self._cola)[2]
+                    self._posicion = 0
+                    self._eventos.put(("inicio", self._actual, False))
+                pcm = self._actual.pcm
+                n = min(frames - escrito, len(pcm) - self._posicion)
+                outdata[escrito:escrito + n, 0] = pcm[self._posicion:self._posicion + n]
+                escrito += n
+                self._posicion += n
+                if self._posicion >= len(pcm):
+                    self._eventos.put(("fin", self._actual, False))
+                    self._actual = None
+        outdata[escrito:] = 0
+        if escrito:
+            self._niveles.append(10.0 * np.log10(np.mean(np.square(outdata[:escrito])) + 1e-12))
+        else:
+            self._niveles.append(None)
+
+    def _despachar(self):
+        while True:
+            tipo, enunciado, cancelado = self._eventos.get()
+            if tipo is None:
+                return
+            try:
+                if tipo == "inicio":
+                    if enunciado.on_inicio:
+                        enunciado.on_inicio(enunciado)
+                else:
+                    if cancelado:
+                        self.cancelados += 1
+                    else:
+                        self.reproducidos += 1
+                    if enunciado.on_fin:
+                        enunciado.on_fin(enunciado, cancelado)
+            except Exception as e:
+                logging.error(f"Error en callback de salida de audio: {e}", exc_info=True)
+
+    def nivel_referencia(self):
+        """Nivel máximo reciente (dBFS) de lo reproducido, o None si no suena nada"""
+        niveles = [n for n in list(self._niveles) if n is not None]
+        return max(niveles) if niveles else None
+
+    @property
+    def profundidad(self):
+        with self._lock:
+            return len(self._cola) + (self._actual is not None)
+
+    def estadisticas(self):
+        return {
+            "profundidad": self.profundidad,
+            "underruns": self.underruns,
+            "reproducidos": self.reproducidos,
+            "cancelados": self.cancelados
+        }
+
+    def cerrar(self):
+        self.detener()
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        if self._despachador is not None:
+            self._eventos.put((None, None, False))
+            self._despachador.join(timeout=1)
+            self._despachador = None
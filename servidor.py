@@ -0,0 +1,462 @@
+import perfil_arranque  # primero: marca el instante cero del perfil de arranque
+import asyncio
+import base64
+import functools
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from aiohttp import web, WSMsgType
+
+import configuracion
+import nucleo
+from asr import BackendASR
+from planificador_asr import PlanificadorASR
+from salida_audio import decodificar_audio
+from sesiones import GestorSesiones
+from tts import SegmentadorFrases, segmentar_texto
+
+
+# Modo sin interfaz: la misma tubería ASR -> LLM -> TTS servida por HTTP y WebSocket,
+# sin Qt ni display virtual.
+#
+#   GET  /salud        estado del servidor y de las colas
+#   POST /transcribir  cuerpo = archivo de audio (wav/flac/ogg...) -> {"texto": ...}
+#   POST /conversar    JSON {"texto": ...} o cuerpo de audio -> NDJSON de eventos (audio en base64)
+#   POST /sintetizar   JSON {"texto": ...} -> audio codificado del motor TTS
+#   DELETE /sesion/{id} cierra una sesión y borra su espacio temporal
+#   GET  /ws           WebSocket: mensajes JSON {"tipo": "texto", "texto": ...},
+#                      {"tipo": "inicio_audio"} + tramas binarias PCM int16 mono 16 kHz
+#                      + {"tipo": "fin_audio"}; la respuesta llega como eventos JSON
+#                      y cada frase sintetizada como un evento "audio" seguido de una trama binaria
+#
+# Eventos: sesion, transcripcion, token, respuesta, audio, fin, error.
+#
+# Cada cliente conversa en su propia sesión: /conversar la recibe en la cabecera X-Sesion
+# (o ?sesion=) y /ws en ?sesion=; si no existe o expiró se crea una nueva y se anuncia
+# con el evento "sesion".
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+class ColaLlena(Exception):
+    pass
+
+
+class ASRNoDisponible(Exception):
+    pass
+
+
+def _texto(datos):
+    texto = datos.get("texto")
+    return texto.strip() if isinstance(texto, str) else ""
+
+
+class ServidorAsistente:
+    def __init__(self):
+        # Decodificaciones directas: como mucho servidor_workers_asr a la vez
+        self.pool_asr = ThreadPoolExecutor(configuracion.servidor_workers_asr, thread_name_prefix="asr")
+        # Con micro-lotes decodifica el hilo del planificador; los de este pool solo esperan a su
+        # lote, así que hacen falta tantos como turnos caben en uno
+        self.pool_lotes = None
+        self.pool_tts = ThreadPoolExecutor(configuracion.servidor_workers_tts, thread_name_prefix="tts")
+        self.pool_llm = ThreadPoolExecutor(configuracion.servidor_workers_llm, thread_name_prefix="llm")
+        self.motor_tts = nucleo.crear_tts()
+        self.cache_respuestas = nucleo.crear_cache_respuestas()
+        self.sesiones = GestorSesiones(
+            configuracion.nombre_asistente,
+            configuracion.sesiones_dir_temporal,
+            configuracion.sesiones_dir_conversaciones,
+            inactividad_segundos=configuracion.sesiones_inactividad_segundos,
+            limite_bytes=configuracion.sesiones_memoria_mb * 1024 * 1024
+        )
+        self._purga = None
+        # Con sesiones vivas el modelo se mantiene cargado en Ollama
+        self.mantenedor_llm = nucleo.MantenedorLLM(
+            configuracion.llm_modelo,
+            configuracion.llm_keep_alive,
+            configuracion.llm_ping_segundos,
+            hay_actividad=lambda: len(self.sesiones) > 0
+        )
+        self.backend_asr = None
+        self.planificador = None
+        self._asr_listo = None
+        self.error_asr = None
+        # Turnos admitidos en ASR (decodificando + en espera); el resto se rechaza con 503
+        self._plazas_asr = None
+        self.turnos_asr = 0
+        self.rechazados_asr = 0
+
+    async def al_arrancar(self, app):
+        self._asr_listo = asyncio.Event()
+        self._plazas_asr = asyncio.Semaphore(configuracion.servidor_workers_asr + configuracion.servidor_cola_asr)
+        asyncio.get_running_loop().create_task(self._cargar_asr())
+        self.mantenedor_llm.iniciar(on_listo=lambda segundos: perfil_arranque.marcar("LLM precargado", segundos))
+        self._purga = asyncio.get_running_loop().create_task(self._purgar_sesiones())
+
+    async def _purgar_sesiones(self):
+        intervalo = max(1, min(60, configuracion.sesiones_inactividad_segundos // 4))
+        while True:
+            await asyncio.sleep(intervalo)
+            self.sesiones.purgar()
+
+    async def _cargar_asr(self):
+        inicio = time.perf_counter()
+        try:
+            backend = await asyncio.get_running_loop().run_in_executor(
+                self.pool_asr, nucleo.cargar_backend_asr, configuracion.servidor_workers_asr)
+            perfil_arranque.marcar(f"importar {backend.nombre}", backend.tiempos.get("importar"))
+            perfil_arranque.marcar(f"cargar modelo ASR '{configuracion.asr_modelo}'", backend.tiempos.get("cargar"))
+            if configuracion.asr_lote_max > 1 and type(backend).transcribir_lote is not BackendASR.transcribir_lote:
+                self.planificador = PlanificadorASR(backend, configuracion.asr_lote_max,
+                                                    configuracion.asr_lote_espera_ms)
+                self.pool_lotes = ThreadPoolExecutor(configuracion.asr_lote_max, thread_name_prefix="asr-lote")
+                backend = self.planificador
+            self.backend_asr = backend
+            perfil_arranque.marcar("reconocimiento de voz listo", time.perf_counter() - inicio)
+        except Exception as e:
+            logging.critical(f"Error cargando modelo ASR: {str(e)}", exc_info=True)
+            self.error_asr = f"{type(e).__name__}: {e}"
+        # También si falla: los turnos en espera se despiertan y fallan en vez de esperar siempre
+        self._asr_listo.set()
+        perfil_arranque.informe()
+
+    async def al_cerrar(self, app):
+        logging.info(f"Estadísticas de caché TTS: {self.motor_tts.cache.estadisticas()}")
+        logging.info(f"Estadísticas de sesiones: {self.sesiones.estadisticas()}")
+        if self.cache_respuestas:
+            logging.info(f"Estadísticas de caché de respuestas: {self.cache_respuestas.estadisticas()}")
+        self._purga.cancel()
+        self.mantenedor_llm.detener()
+        if self.planificador is not None:
+            logging.info(f"Estadísticas de micro-lotes ASR: {self.planificador.estadisticas()}")
+            self.planificador.cerrar()
+        self.sesiones.cerrar_todas()
+        for pool in (self.pool_asr, self.pool_lotes, self.pool_tts, self.pool_llm):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    # --- Tubería -----------------------------------------------------------
+
+    async def transcribir(self, audio, samplerate):
+        """Transcribe una grabación completa en el pool de ASR; "" si no contiene voz"""
+        if self.error_asr:
+            raise ASRNoDisponible()
+        if self._plazas_asr.locked():
+            self.rechazados_asr += 1
+            raise ColaLlena()
+        async with self._plazas_asr:
+            await self._asr_listo.wait()
+            if self.error_asr:
+                raise ASRNoDisponible()
+            self.turnos_asr += 1
+            return await asyncio.get_running_loop().run_in_executor(
+                self.pool_lotes or self.pool_asr, self._transcribir, audio, samplerate)
+
+    def _transcribir(self, audio, samplerate):
+        audio = nucleo.preparar_audio(audio, samplerate)
+        if audio is None:
+            return ""
+        # El transcriptor guarda estado incremental: uno por turno
+        return nucleo.transcribir(nucleo.crear_transcriptor(self.backend_asr), audio)
+
+    async def conversar(self, sesion, texto, emitir):
+        """Genera la respuesta a un turno y emite tokens y audio por frases a medida que salen"""
+        loop = asyncio.get_running_loop()
+        conversacion = sesion.conversacion
+        sesion.agregar_mensaje(f"Tú: {texto}")
+        frases = asyncio.Queue()
+
+        async def enviar_audio():
+            while True:
+                item = await frases.get()
+                if item is None:
+                    return
+                frase, futuro = item
+                try:
+                    resultado = await futuro
+                except Exception as e:
+                    logging.error(f"ERROR en síntesis: {str(e)}", exc_info=True)
+                    continue
+                await emitir({"tipo": "audio", "frase": frase, "formato": resultado.formato}, resultado.audio)
+
+        def sintetizar(frase):
+            # La síntesis de cada frase arranca en cuanto se cierra; el envío respeta el orden
+            frases.put_nowait((frase, loop.run_in_executor(self.pool_tts, self.motor_tts.sintetizar, frase)))
+
+        emisor = asyncio.create_task(enviar_audio())
+        cancelado = threading.Event()
+        try:
+            respuesta = conversacion.respuesta_directa(texto)
+            contexto = conversacion.contexto_cache(texto)
+            usar_cache = self.cache_respuestas is not None and contexto is not None
+            en_cache = None
+            if not respuesta and usar_cache:
+                # La lectura en SQLite (y su UPDATE en un acierto) no debe frenar el bucle de eventos
+                respuesta = en_cache = await loop.run_in_executor(self.pool_llm, functools.partial(
+                    self.cache_respuestas.obtener, texto, **contexto))
+                if en_cache:
+                    conversacion.registrar_turno(texto, en_cache)
+            if respuesta:
+                await emitir({"tipo": "respuesta", "texto": respuesta, "cache": bool(en_cache)})
+                for frase in segmentar_texto(respuesta):
+                    sintetizar(frase)
+            else:
+                metricas = {}
+                respuesta = await self._generar(conversacion.mensajes_chat(texto), emitir, sintetizar,
+                                                cancelado, metricas)
+                if metricas:
+                    conversacion.registrar_turno(texto, respuesta, metricas)
+                    if usar_cache:
+                        # La escritura en SQLite no debe frenar el bucle de eventos
+                        loop.run_in_executor(self.pool_llm, functools.partial(
+                            self.cache_respuestas.guardar, texto, respuesta, metricas["segundos"], **contexto))
+            sesion.agregar_mensaje(f"{conversacion.nombre_asistente}: {respuesta}")
+            frases.put_nowait(None)
+            await emisor
+            await emitir({"tipo": "fin"})
+        finally:
+            cancelado.set()
+            emisor.cancel()
+
+    async def _generar(self, mensajes, emitir, sintetizar, cancelado, metricas):
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+
+        def producir():
+            try:
+                for token in nucleo.generar_tokens(mensajes, configuracion.llm_modelo, cancelado.is_set, metricas):
+                    loop.call_soon_threadsafe(tokens.put_nowait, token)
+            except Exception as e:
+                logging.error(f"Error al generar respuesta: {e}")
+            finally:
+                loop.call_soon_threadsafe(tokens.put_nowait, None)
+
+        productor = loop.run_in_executor(self.pool_llm, producir)
+        segmentador = SegmentadorFrases()
+        partes = []
+        while True:
+            token = await tokens.get()
+            if token is None:
+                break
+            partes.append(token)
+            await emitir({"tipo": "token", "texto": token})
+            for frase in segmentador.agregar(token):
+                sintetizar(frase)
+        await productor
+
+        respuesta = "".join(partes).strip()
+        frases = segmentador.vaciar()
+        if not respuesta:
+            respuesta = nucleo.RESPUESTA_ERROR
+            frases = segmentar_texto(respuesta)
+        for frase in frases:
+            sintetizar(frase)
+        await emitir({"tipo": "respuesta", "texto": respuesta,
+                      "prompt_eval_count": metricas.get("prompt_eval_count"),
+                      "eval_count": metricas.get("eval_count"),
+                      "load_duration": metricas.get("load_duration"),
+                      "prompt_eval_duration": metricas.get("prompt_eval_duration"),
+                      "eval_duration": metricas.get("eval_duration")})
+        return respuesta
+
+    # --- HTTP ----------------------------------------------------------------
+
+    async def salud(self, request):
+        return web.json_response({
+            "asr_listo": self.backend_asr is not None,
+            "asr_error": self.error_asr,
+            "asr_backend": self.backend_asr.nombre if self.backend_asr else None,
+            "turnos_asr": self.turnos_asr,
+            "rechazados_asr": self.rechazados_asr,
+            "lotes_asr": self.planificador.estadisticas() if self.planificador else None,
+            "sesiones": self.sesiones.estadisticas(),
+            "llm": self.mantenedor_llm.estadisticas(),
+            "cache_tts": self.motor_tts.cache.estadisticas(),
+            "cache_respuestas": self.cache_respuestas.estadisticas() if self.cache_respuestas else None
+        })
+
+    async def _leer_json(self, request):
+        try:
+            datos = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="JSON no válido")
+        if not isinstance(datos, dict):
+            raise web.HTTPBadRequest(text="Se esperaba un objeto JSON")
+        return datos
+
+    async def _transcribir_http(self, pcm, samplerate):
+        try:
+            return await self.transcribir(pcm, samplerate)
+        except ColaLlena:
+            raise web.HTTPServiceUnavailable(text="Cola de transcripción llena")
+        except ASRNoDisponible:
+            raise web.HTTPServiceUnavailable(text=f"Reconocimiento de voz no disponible: {self.error_asr}")
+
+    async def _leer_audio(self, request):
+        try:
+            return decodificar_audio(await request.read())
+        except Exception as e:
+            raise web.HTTPBadRequest(text=f"Audio no válido: {e}")
+
+    async def http_transcribir(self, request):
+        pcm, samplerate = await self._leer_audio(request)
+        texto = await self._transcribir_http(pcm, samplerate)
+        return web.json_response({"texto": texto})
+
+    async def http_sintetizar(self, request):
+        texto = _texto(await self._leer_json(request))
+        if not texto:
+            raise web.HTTPBadRequest(text="Falta el texto")
+        resultado = await asyncio.get_running_loop().run_in_executor(
+            self.pool_tts, self.motor_tts.sintetizar, texto)
+        tipo = "audio/mpeg" if resultado.formato == "mp3" else f"audio/{resultado.formato}"
+        return web.Response(body=resultado.audio, content_type=tipo)
+
+    async def http_cerrar_sesion(self, request):
+        self.sesiones.cerrar(request.match_info["id"])
+        return web.json_response({"cerrada": request.match_info["id"]})
+
+    async def http_conversar(self, request):
+        sesion = self.sesiones.obtener_o_crear(
+            request.headers.get("X-Sesion") or request.query.get("sesion"))
+        if request.content_type == "application/json":
+            texto = _texto(await self._leer_json(request))
+        else:
+            pcm, samplerate = await self._leer_audio(request)
+            texto = await self._transcribir_http(pcm, samplerate)
+
+        respuesta = web.StreamResponse(headers={"Content-Type": "application/x-ndjson", "X-Sesion": sesion.id})
+        await respuesta.prepare(request)
+
+        async def emitir(evento, datos=None):
+            if datos is not None:
+                evento = dict(evento, audio=base64.b64encode(datos).decode("ascii"))
+            await respuesta.write((json.dumps(evento, ensure_ascii=False) + "\n").encode("utf-8"))
+
+        await emitir({"tipo": "sesion", "id": sesion.id})
+        await emitir({"tipo": "transcripcion", "texto": texto})
+        # Un turno vacío no llega ni al LLM ni al TTS
+        if texto:
+            with self.sesiones.usar(sesion):
+                await self.conversar(sesion, texto, emitir)
+        await respuesta.write_eof()
+        return respuesta
+
+    # --- WebSocket -----------------------------------------------------------
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse(max_msg_size=configuracion.servidor_max_audio_mb * 1024 * 1024)
+        await ws.prepare(request)
+        sesion = self.sesiones.obtener_o_crear(request.query.get("sesion"))
+        limite_audio = configuracion.servidor_max_audio_mb * 1024 * 1024
+        grabando = False
+        bytes_audio = 0
+        turno = None
+
+        async def emitir(evento, datos=None):
+            await ws.send_json(evento)
+            if datos is not None:
+                await ws.send_bytes(datos)
+
+        async def atender(texto=None, audio=None):
+            try:
+                if audio is not None:
+                    texto = await self.transcribir(audio, configuracion.asr_samplerate)
+                    await emitir({"tipo": "transcripcion", "texto": texto})
+                if texto:
+                    await self.conversar(sesion, texto, emitir)
+                else:
+                    await emitir({"tipo": "fin"})
+            except ColaLlena:
+                await emitir({"tipo": "error", "mensaje": "Cola de transcripción llena"})
+                await emitir({"tipo": "fin"})
+            except ASRNoDisponible:
+                await emitir({"tipo": "error", "mensaje": f"Reconocimiento de voz no disponible: {self.error_asr}"})
+                await emitir({"tipo": "fin"})
+            except ConnectionResetError:
+                pass
+            except Exception as e:
+                logging.error(f"Error atendiendo turno por WebSocket: {e}", exc_info=True)
+                try:
+                    await emitir({"tipo": "error", "mensaje": "Error interno"})
+                    await emitir({"tipo": "fin"})
+                except ConnectionResetError:
+                    pass
+
+        def nuevo_turno(**kwargs):
+            # Un turno nuevo interrumpe al anterior, como en la GUI
+            nonlocal turno
+            if turno is not None and not turno.done():
+                turno.cancel()
+            turno = asyncio.create_task(atender(**kwargs))
+
+        await emitir({"tipo": "sesion", "id": sesion.id})
+        try:
+            with self.sesiones.usar(sesion):
+                async for mensaje in ws:
+                    if mensaje.type == WSMsgType.BINARY:
+                        if not grabando:
+                            continue
+                        bytes_audio += len(mensaje.data) * 2
+                        if bytes_audio > limite_audio:
+                            grabando = False
+                            sesion.descartar_audio()
+                            await emitir({"tipo": "error", "mensaje": "Audio demasiado largo"})
+                            continue
+                        sesion.agregar_audio(np.frombuffer(mensaje.data, dtype="<i2") / 32768.0)
+                    elif mensaje.type == WSMsgType.TEXT:
+                        try:
+                            datos = json.loads(mensaje.data)
+                        except ValueError:
+                            await emitir({"tipo": "error", "mensaje": "JSON no válido"})
+                            continue
+                        if not isinstance(datos, dict):
+                            await emitir({"tipo": "error", "mensaje": "Se esperaba un objeto JSON"})
+                            continue
+                        tipo = datos.get("tipo")
+                        if tipo == "texto" and _texto(datos):
+                            nuevo_turno(texto=_texto(datos))
+                        elif tipo == "inicio_audio":
+                            sesion.descartar_audio()
+                            grabando = True
+                            bytes_audio = 0
+                        elif tipo == "fin_audio" and grabando:
+                            grabando = False
+                            nuevo_turno(audio=sesion.tomar_audio())
+                        elif tipo == "cancelar" and turno is not None:
+                            turno.cancel()
+                    elif mensaje.type == WSMsgType.ERROR:
+                        logging.error(f"Error en WebSocket: {ws.exception()}")
+        finally:
+            if turno is not None:
+                turno.cancel()
+            sesion.descartar_audio()
+        return ws
+
+
+def crear_aplicacion():
+    servidor = ServidorAsistente()
+    app = web.Application(client_max_size=configuracion.servidor_max_audio_mb * 1024 * 1024)
+    app.on_startup.append(servidor.al_arrancar)
+    app.on_cleanup.append(servidor.al_cerrar)
+    app.add_routes([
+        web.get("/salud", servidor.salud),
+        web.post("/transcribir", servidor.http_transcribir),
+        web.post("/conversar", servidor.http_conversar),
+        web.post("/sintetizar", servidor.http_sintetizar),
+        web.delete("/sesion/{id}", servidor.http_cerrar_sesion),
+        web.get("/ws", servidor.websocket)
+    ])
+    return app
+
+
+if __name__ == "__main__":
+    perfil_arranque.marcar("importaciones")
+    web.run_app(crear_aplicacion(), host=configuracion.servidor_host, port=configuracion.servidor_puerto)
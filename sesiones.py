@@ -0,0 +1,183 @@
+import collections
+import contextlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from nucleo import Conversacion
+
+
+class Sesion:
+    """Estado de un usuario: conversación, audio pendiente, preferencias y espacio de archivos propio"""
+
+    def __init__(self, id, nombre_asistente, directorio_temporal, ruta_conversacion,
+                 nombre_usuario=None, preferencias=None):
+        self.id = id
+        self.conversacion = Conversacion(nombre_asistente, nombre_usuario)
+        self.preferencias = dict(preferencias or {})
+        self.directorio_temporal = directorio_temporal
+        self.ruta_conversacion = ruta_conversacion
+        self.creada = time.monotonic()
+        self.ultimo_uso = self.creada
+        self.en_uso = 0
+        self._audio = []
+        self._lock = threading.Lock()
+
+    def tocar(self):
+        self.ultimo_uso = time.monotonic()
+
+    def ruta_temporal(self, nombre):
+        os.makedirs(self.directorio_temporal, exist_ok=True)
+        return os.path.join(self.directorio_temporal, nombre)
+
+    def agregar_mensaje(self, mensaje):
+        self.tocar()
+        self.conversacion.agregar(mensaje)
+        try:
+            with open(self.ruta_conversacion, "a", encoding="utf-8") as archivo:
+                archivo.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {mensaje}\n")
+        except Exception as e:
+            logging.error(f"Error al guardar conversación: {e}")
+
+    def agregar_audio(self, bloque):
+        with self._lock:
+            self._audio.append(np.asarray(bloque, dtype=np.float32))
+
+    def tomar_audio(self):
+        """Devuelve y vacía el audio acumulado"""
+        with self._lock:
+            bloques, self._audio = self._audio, []
+        return np.concatenate(bloques) if bloques else np.zeros(0, dtype=np.float32)
+
+    def descartar_audio(self):
+        with self._lock:
+            self._audio = []
+
+    @property
+    def bytes_memoria(self):
+        with self._lock:
+            audio = sum(b.nbytes for b in self._audio)
+        texto = sum(len(m) for m in self.conversacion.mensajes) * 2
+        return audio + texto
+
+    def cerrar(self):
+        self.descartar_audio()
+        shutil.rmtree(self.directorio_temporal, ignore_errors=True)
+
+
+class GestorSesiones:
+    """Registro de sesiones con expiración por inactividad y tope de memoria total"""
+
+    def __init__(self, nombre_asistente, directorio_temporal, directorio_conversaciones,
+                 inactividad_segundos=900, limite_bytes=256 * 1024 * 1024):
+        self.nombre_asistente = nombre_asistente
+        self.directorio_temporal = directorio_temporal
+        self.directorio_conversaciones = directorio_conversaciones
+        self.inactividad_segundos = inactividad_segundos
+        self.limite_bytes = limite_bytes
+        self._lock = threading.Lock()
+        self._sesiones = collections.OrderedDict()  # id -> Sesion, de la menos a la más reciente
+        self.creadas = 0
+        self.expiradas = 0
+        self.desalojadas = 0
+        os.makedirs(directorio_conversaciones, exist_ok=True)
+
+    def crear(self, nombre_usuario=None, preferencias=None):
+        id = uuid.uuid4().hex
+        sesion = Sesion(
+            id,
+            self.nombre_asistente,
+            os.path.join(self.directorio_temporal, id),
+            os.path.join(self.directorio_conversaciones, f"{id}.txt"),
+            nombre_usuario,
+            preferencias
+        )
+        # Se purga antes de registrarla para que la nueva nunca sea la desalojada
+        self.purgar()
+        with self._lock:
+            self._sesiones[id] = sesion
+            self.creadas += 1
+        return sesion
+
+    def obtener(self, id):
+        """Sesión viva con ese id (marcada como usada) o None si no existe o ya expiró"""
+        with self._lock:
+            sesion = self._sesiones.get(id)
+            if sesion is not None:
+                self._sesiones.move_to_end(id)
+                sesion.tocar()
+        return sesion
+
+    def obtener_o_crear(self, id=None, **kwargs):
+        return (self.obtener(id) if id else None) or self.crear(**kwargs)
+
+    @contextlib.contextmanager
+    def usar(self, sesion):
+        """Mientras dura el bloque la sesión no expira por inactividad"""
+        with self._lock:
+            sesion.en_uso += 1
+        try:
+            yield sesion
+        finally:
+            with self._lock:
+                sesion.en_uso -= 1
+                sesion.tocar()
+
+    def cerrar(self, id):
+        with self._lock:
+            sesion = self._sesiones.pop(id, None)
+        if sesion is not None:
+            sesion.cerrar()
+
+    def purgar(self):
+        """Expira las sesiones inactivas y desaloja las menos recientes si se supera el tope de memoria"""
+        cerradas = []
+        ahora = time.monotonic()
+        with self._lock:
+            for id, sesion in list(self._sesiones.items()):
+                if not sesion.en_uso and ahora - sesion.ultimo_uso > self.inactividad_segundos:
+                    cerradas.append(self._sesiones.pop(id))
+                    self.expiradas += 1
+
+            total = sum(s.bytes_memoria for s in self._sesiones.values())
+            for id, sesion in list(self._sesiones.items()):
+                if total <= self.limite_bytes:
+                    break
+                if sesion.en_uso:
+                    continue
+                total -= sesion.bytes_memoria
+                cerradas.append(self._sesiones.pop(id))
+                self.desalojadas += 1
+
+        for sesion in cerradas:
+            logging.info(f"Sesión {sesion.id} cerrada tras {ahora - sesion.creada:.0f}s")
+            sesion.cerrar()
+        return len(cerradas)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sesiones)
+
+    def estadisticas(self):
+        with self._lock:
+            sesiones = list(self._sesiones.values())
+            return {
+                "activas": len(sesiones),
+                "en_uso": sum(1 for s in sesiones if s.en_uso),
+                "bytes_memoria": sum(s.bytes_memoria for s in sesiones),
+                "creadas": self.creadas,
+                "expiradas": self.expiradas,
+                "desalojadas": self.desalojadas
+            }
+
+    def cerrar_todas(self):
+        with self._lock:
+            sesiones = list(self._sesiones.values())
+            self._sesiones.clear()
+        for sesion in sesiones:
+            sesion.cerrar()
@@ -0,0 +1,51 @@
+import pytest
+
+from comandos import COMANDOS, RouterComandos
+
+
+@pytest.fixture(scope="module")
+def router():
+    return RouterComandos(COMANDOS)
+
+
+@pytest.mark.parametrize("texto", [
+    "¿Por qué ir a la playa es bueno?",
+    "Quiero ir a Madrid mañana",
+    "ve a dormir",
+    "¿Qué pasa si abro la calculadora?",
+    "Me gustaría saber cómo abrir Chrome en Linux",
+    "Ir a la tienda es aburrido",
+    "reproducir",
+    "abre chrome y luego el correo",
+])
+def test_preguntas_normales_no_son_ordenes(router, texto):
+    assert router.resolver(texto, "ELISA") is None
+
+
+@pytest.mark.parametrize("texto, nombre", [
+    ("abrir chrome", "abrir Chrome"),
+    ("Abre Crome", "abrir Chrome"),
+    ("ELISA, abrir calculadoras", "abrir la calculadora"),
+    ("Por favor, ábre la calculadora", "abrir la calculadora"),
+    ("abrir bloc de notas por favor", "abrir el bloc de notas"),
+])
+def test_ordenes_con_errores_del_asr(router, texto, nombre):
+    intencion = router.resolver(texto, "ELISA")
+    assert intencion is not None and intencion.comando.nombre == nombre
+
+
+@pytest.mark.parametrize("texto, parametro", [
+    ("ir a google.com", "google.com"),
+    ("ve a wikipedia punto org", "wikipedia.org"),
+    ("abre la página https://example.com/ruta", "https://example.com/ruta"),
+])
+def test_ir_a_requiere_dominio(router, texto, parametro):
+    intencion = router.resolver(texto)
+    assert intencion.comando.nombre == "abrir la página"
+    assert intencion.parametro == parametro
+
+
+def test_cancion_sin_preposicion(router):
+    intencion = router.resolver("pon la canción de queen")
+    assert intencion.comando.nombre == "reproducir eso"
+    assert intencion.parametro == "queen"
@@ -0,0 +1,227 @@
+import abc
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import time
+import wave
+
+
+class SegmentadorFrases:
+    """Agrupa los tokens del LLM en frases o cláusulas listas para sintetizar"""
+
+    FIN_FRASE = re.compile(r'[.!?…]+["»)\]]*\s')
+    FIN_CLAUSULA = re.compile(r'[,;:]\s')
+    ABREVIATURAS = {"sr", "sra", "srta", "dr", "dra", "ud", "uds", "etc", "pág", "núm", "aprox", "ej"}
+
+    def __init__(self, minimo_primera=20, minimo_clausula=60, maximo=200):
+        self.minimo_primera = minimo_primera
+        self.minimo_clausula = minimo_clausula
+        self.maximo = maximo
+        self.reiniciar()
+
+    def reiniciar(self):
+        self._buffer = ""
+        self._emitidas = 0
+
+    def _es_abreviatura(self, fin):
+        palabras = self._buffer[:fin].split()
+        return bool(palabras) and palabras[-1].rstrip(".").lower() in self.ABREVIATURAS
+
+    def _corte(self):
+        for m in self.FIN_FRASE.finditer(self._buffer):
+            if self._buffer[m.start()] == "." and self._es_abreviatura(m.start()):
+                continue
+            return m.end()
+
+        # La primera cláusula se corta antes para que la voz empiece cuanto antes
+        minimo = self.minimo_primera if self._emitidas == 0 else self.minimo_clausula
+        for m in self.FIN_CLAUSULA.finditer(self._buffer):
+            if m.end() >= minimo:
+                return m.end()
+
+        if len(self._buffer) > self.maximo:
+            espacio = self._buffer.rfind(" ", 0, self.maximo)
+            return espacio + 1 if espacio > 0 else self.maximo
+        return None
+
+    def agregar(self, texto):
+        """Añade texto y devuelve las frases que quedaron completas"""
+        self._buffer += texto
+        frases = []
+        while True:
+            corte = self._corte()
+            if corte is None:
+                break
+            frase = self._buffer[:corte].strip()
+            self._buffer = self._buffer[corte:]
+            if frase:
+                frases.append(frase)
+                self._emitidas += 1
+        return frases
+
+    def vaciar(self):
+        """Devuelve lo que quede pendiente al terminar el stream"""
+        frase = self._buffer.strip()
+        self.reiniciar()
+        return [frase] if frase else []
+
+
+def segmentar_texto(texto):
+    segmentador = SegmentadorFrases()
+    return segmentador.agregar(texto) + segmentador.vaciar()
+
+
+class ResultadoTTS:
+    """Audio codificado producido por un motor junto con sus métricas"""
+
+    def __init__(self, audio, formato, segundos_sintesis, duracion=None):
+        self.audio = audio
+        self.formato = formato
+        self.segundos_sintesis = segundos_sintesis
+        self.duracion = duracion
+
+    @property
+    def rtf(self):
+        """Factor de tiempo real: segundos de síntesis por segundo de audio"""
+        if not self.duracion:
+            return None
+        return self.segundos_sintesis / self.duracion
+
+
+class MotorTTS(abc.ABC):
+    """Interfaz común de los motores de síntesis"""
+
+    nombre = "base"
+    formato = "wav"
+
+    def __init__(self, idioma="es", voz=None):
+        self.idioma = idioma
+        self.voz = voz
+
+    @property
+    def identidad(self):
+        """Todo lo que determina cómo suena una frase: forma parte de la clave de la caché"""
+        return f"{self.nombre}|{self.voz or ''}|{self.idioma}"
+
+    @abc.abstractmethod
+    def _sintetizar(self, texto):
+        """Audio codificado (bytes en `formato`) de `texto`"""
+
+    def sintetizar(self, texto):
+        inicio = time.perf_counter()
+        audio = self._sintetizar(texto)
+        resultado = ResultadoTTS(audio, self.formato, time.perf_counter() - inicio, duracion_audio(audio))
+        if resultado.rtf is not None:
+            logging.info(f"TTS {self.nombre}: {resultado.segundos_sintesis:.2f}s para "
+                         f"{resultado.duracion:.2f}s de audio (RTF {resultado.rtf:.2f})")
+        return resultado
+
+
+class MotorGTTS(MotorTTS):
+    """Google Translate TTS (requiere conexión)"""
+
+    nombre = "gtts"
+    formato = "mp3"
+
+    def _sintetizar(self, texto):
+        from gtts import gTTS
+
+        buffer = io.BytesIO()
+        gTTS(text=texto, lang=self.idioma, slow=False).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class MotorEspeak(MotorTTS):
+    """espeak-ng local por subproceso"""
+
+    nombre = "espeak"
+
+    def __init__(self, idioma="es", voz=None):
+        super().__init__(idioma, voz)
+        self.ejecutable = shutil.which("espeak-ng") or shutil.which("espeak")
+        if not self.ejecutable:
+            raise RuntimeError("No se encontró espeak-ng en el PATH")
+
+    def _sintetizar(self, texto):
+        proceso = subprocess.run(
+            [self.ejecutable, "-v", self.voz or self.idioma, "--stdout", texto],
+            capture_output=True,
+            check=True
+        )
+        return proceso.stdout
+
+
+class MotorPiper(MotorTTS):
+    """Piper (voces neuronales ONNX) local por subproceso"""
+
+    nombre = "piper"
+
+    def __init__(self, idioma="es", voz=None, modelo=None):
+        super().__init__(idioma, voz)
+        self.ejecutable = shutil.which("piper")
+        if not self.ejecutable:
+            raise RuntimeError("No se encontró piper en el PATH")
+        if not modelo or not os.path.exists(modelo):
+            raise RuntimeError(f"Modelo de Piper no encontrado: {modelo}")
+        self.modelo = modelo
+        self._version_modelo = os.path.getmtime(modelo)
+        with open(f"{modelo}.json", encoding="utf-8") as archivo:
+            self.samplerate = json.load(archivo)["audio"]["sample_rate"]
+
+    @property
+    def identidad(self):
+        # La voz es el modelo .onnx; `voz` solo elige el locutor dentro de él
+        return f"{super().identidad}|{os.path.abspath(self.modelo)}|{self._version_modelo:.0f}"
+
+    def _sintetizar(self, texto):
+        comando = [self.ejecutable, "--model", self.modelo, "--output-raw"]
+        if self.voz:
+            comando += ["--speaker", str(self.voz)]
+        proceso = subprocess.run(comando, input=texto.encode("utf-8"), capture_output=True, check=True)
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.samplerate)
+            wav.writeframes(proceso.stdout)
+        return buffer.getvalue()
+
+
+MOTORES = {
+    "gtts": MotorGTTS,
+    "espeak": MotorEspeak,
+    "piper": MotorPiper
+}
+
+
+def crear_motor_tts(nombre, idioma="es", voz=None, modelo_piper=None, respaldo=None):
+    """Instancia el motor configurado; si no está disponible se usa `respaldo` o, sin él, falla
+
+    Un motor local no recurre a gTTS por su cuenta: gTTS envía el texto a un servicio externo.
+    """
+    if nombre not in MOTORES:
+        raise ValueError(f"Motor TTS desconocido: {nombre} (opciones: {', '.join(MOTORES)})")
+    try:
+        if nombre == "piper":
+            return MotorPiper(idioma=idioma, voz=voz, modelo=modelo_piper)
+        return MOTORES[nombre](idioma=idioma, voz=voz)
+    except Exception as e:
+        if not respaldo or respaldo == nombre:
+            logging.critical(f"Motor TTS '{nombre}' no disponible: {e}")
+            raise
+        logging.error(f"Motor TTS '{nombre}' no disponible ({e}), se usa {respaldo}")
+        return crear_motor_tts(respaldo, idioma=idioma, voz=voz, modelo_piper=modelo_piper)
+
+
+def duracion_audio(audio):
+    try:
+        import soundfile as sf
+
+        return sf.info(io.BytesIO(audio)).duration
+    except Exception:
+        return None